@@ -1,6 +1,34 @@
+import argparse
+import asyncio
+import atexit
+import bisect
+import builtins
+import copy
+import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import mmap
 import os
+import pickle
+import queue
 import random
-import time  # Added for Dokkan mini-game
+import select
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from collections import deque
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from enum import Enum
 
 # --- ENUMERATIONS (Consolidated) ---
@@ -12,6 +40,8 @@ class Attribute(Enum):
     PHY = "PHY (Orange)"
     RAINBOW = "RAINBOW"
 
+ATTRIBUTE_CODES = {attribute: code for code, attribute in enumerate(Attribute)}  # Small ints for table lookups
+
 class EvasionLevel(Enum):
     NONE = 0
     RARE = 20
@@ -99,6 +129,56 @@ LINK_SKILL_DATABASE = {
     "Legendary Power": (LinkSkillEffect.ATK_PERCENT, 15),
 }
 
+# Leader skills: leader name fragment -> list of boost rules.
+# A rule boosts a member that has at least one category from every group in
+# "any_of" and none of the categories in "none_of". Rules stack.
+LEADER_SKILL_DATABASE = {
+    "Dawn of an Ideal World": [
+        # Reduced multipliers from 2.5 to 1.8
+        {"any_of": [[Category.WORLDWIDE_CHAOS, Category.POTARA]],
+         "hp": 1.8, "atk": 1.8, "def": 1.8, "ki": 4},
+    ],
+    "Infinite Sanctuary": [
+        # Reduced multipliers from 2.7 to 1.9
+        {"any_of": [[Category.REALM_OF_GODS, Category.WORLDWIDE_CHAOS, Category.FUSED_FIGHTERS]],
+         "hp": 1.9, "atk": 1.9, "def": 1.9, "ki": 3},
+        # Reduced multiplier from 1.3 to 1.1
+        {"any_of": [[Category.REALM_OF_GODS, Category.WORLDWIDE_CHAOS, Category.FUSED_FIGHTERS],
+                    [Category.TIME_TRAVELERS, Category.FINAL_TRUMP_CARD]],
+         "hp": 1.1, "atk": 1.1, "def": 1.1, "ki": 0},
+        # Reduced multiplier from 2.5 to 1.7
+        {"none_of": [Category.REALM_OF_GODS, Category.WORLDWIDE_CHAOS, Category.FUSED_FIGHTERS],
+         "hp": 1.7, "atk": 1.7, "def": 1.7, "ki": 3},
+    ],
+    "Rose Stained": [
+        # Reduced multipliers from 3.0 to 2.0
+        {"any_of": [[Category.FUTURE_SAGA, Category.REALM_OF_GODS]],
+         "hp": 2.0, "atk": 2.0, "def": 1.8, "ki": 4},
+    ],
+    "Mastery of the Power of Rage": [
+        # Reduced multipliers from 3.2 to 2.2
+        {"any_of": [[Category.SUPER_BOSSES, Category.CORRODED_BODY_AND_MIND]],
+         "hp": 2.2, "atk": 2.2, "def": 2.0, "ki": 4},
+    ],
+    "Terrifying Zero Mortals Plan": [
+        {"any_of": [[Category.FUTURE_SAGA, Category.REALM_OF_GODS, Category.SUPER_BOSSES]],
+         "hp": 2.0, "atk": 2.0, "def": 1.8, "ki": 4},
+    ],
+}
+
+def get_leader_skill(leader, database=None):
+    """Return the leader skill rules for a character (empty if none)"""
+    for name, rules in (database or LEADER_SKILL_DATABASE).items():
+        if name in leader.name:
+            return rules
+    return []
+
+def leader_rule_applies(rule, categories):
+    """Check if a leader skill rule boosts a member with these categories"""
+    if any(cat in categories for cat in rule.get("none_of", [])):
+        return False
+    return all(any(cat in categories for cat in group) for group in rule.get("any_of", []))
+
 # --- KI SPHERE CLASS ---
 class KiSphere:
     def __init__(self, attribute):
@@ -112,6 +192,155 @@ class KiSphere:
             return "[R]"
         return f"[{self.attribute.value[0]}]"
 
+class KiBoard:
+    """Rules of the Ki sphere grid: size, allowed moves, path length and
+    sphere odds. Cells are numbered row-major, so a set of cells is an int
+    bitmask and best_path() can search boards up to 6x6 without listing
+    every path."""
+    SPHERE_ATTRIBUTES = (Attribute.STR, Attribute.AGL, Attribute.TEQ, Attribute.INT, Attribute.PHY)
+    MOVE_NAMES = {
+        (0, 1): "Right", (1, 0): "Down", (1, 1): "Down-right (diagonal)",
+        (0, -1): "Left", (-1, 0): "Up", (-1, -1): "Up-left (diagonal)",
+        (-1, 1): "Up-right (diagonal)", (1, -1): "Down-left (diagonal)",
+    }
+
+    def __init__(self, rows=3, cols=3, moves=((0, 1), (1, 0), (1, 1)), max_length=7,
+                 rainbow_chance=0.1, attribute_weights=None):
+        if rows * cols > 64:
+            raise ValueError("Ki board too large: at most 64 cells")
+        self.rows = rows
+        self.cols = cols
+        self.moves = tuple(tuple(move) for move in moves)
+        self.max_length = max_length
+        self.rainbow_chance = rainbow_chance
+        self.attribute_weights = dict(attribute_weights) if attribute_weights else None  # {Attribute: weight}; None is uniform
+        self.neighbors = tuple(
+            tuple((row + d_row) * cols + col + d_col for d_row, d_col in self.moves
+                  if 0 <= row + d_row < rows and 0 <= col + d_col < cols)
+            for row in range(rows) for col in range(cols))
+        # Moves that only go right/down can never revisit a cell
+        self.forward = all(d_row > 0 or (d_row == 0 and d_col > 0) for d_row, d_col in self.moves)
+        # reach[steps][cell]: bitmask of the cells within `steps` moves of cell
+        self.reach = [[1 << cell for cell in range(rows * cols)]]
+        for _ in range(max_length - 1):
+            previous, step = self.reach[-1], []
+            for cell, neighbors in enumerate(self.neighbors):
+                mask = previous[cell]
+                for neighbor in neighbors:
+                    mask |= previous[neighbor]
+                step.append(mask)
+            self.reach.append(step)
+
+    def signature(self):
+        """The rules as plain data, for cache keys and scenario hashes"""
+        weights = tuple((attribute.name, weight) for attribute, weight in self.attribute_weights.items()) \
+            if self.attribute_weights else None
+        return (self.rows, self.cols, self.moves, self.max_length, self.rainbow_chance, weights)
+
+    def sphere_chances(self):
+        """{Attribute: chance} for one cell, RAINBOW included"""
+        weights = self.attribute_weights or dict.fromkeys(self.SPHERE_ATTRIBUTES, 1)
+        total = sum(weights.values())
+        chances = {attribute: (1 - self.rainbow_chance) * weight / total for attribute, weight in weights.items()}
+        chances[Attribute.RAINBOW] = chances.get(Attribute.RAINBOW, 0) + self.rainbow_chance
+        return chances
+
+    def move_name(self, move):
+        return self.MOVE_NAMES.get(move, f"Move {move[0]:+d} row, {move[1]:+d} col")
+
+    def generate(self):
+        """Fresh grid of KiSphere rows"""
+        attributes = list(self.SPHERE_ATTRIBUTES)
+        weights = None
+        if self.attribute_weights:
+            attributes = list(self.attribute_weights)
+            weights = list(self.attribute_weights.values())
+        grid = []
+        for _ in range(self.rows):
+            row = []
+            for _ in range(self.cols):
+                if random.random() < self.rainbow_chance:
+                    row.append(KiSphere(Attribute.RAINBOW))
+                elif weights:
+                    row.append(KiSphere(random.choices(attributes, weights)[0]))
+                else:
+                    row.append(KiSphere(random.choice(attributes)))
+            grid.append(row)
+        return grid
+
+    def best_path(self, values):
+        """Path with the highest total of values (one per cell, row-major, all
+        positive): returns ((row, col), ...), total"""
+        size = self.rows * self.cols
+        if self.forward:
+            cells, total = self._forward_path(values, size)
+        else:
+            cells, total = self._bitmask_path(values, size)
+        return tuple(divmod(cell, self.cols) for cell in cells), total
+
+    def _forward_path(self, values, size):
+        # best[cell]: most Ki from a path of up to n spheres starting at cell
+        best = list(values)
+        steps = []
+        for _ in range(self.max_length - 1):
+            nexts = [None] * size
+            extended = [0] * size
+            for cell in range(size):
+                gain, chosen = 0, None
+                for neighbor in self.neighbors[cell]:
+                    if best[neighbor] > gain:
+                        gain, chosen = best[neighbor], neighbor
+                extended[cell] = values[cell] + gain
+                nexts[cell] = chosen
+            steps.append(nexts)
+            best = extended
+        cell = max(range(size), key=best.__getitem__)
+        total, cells = best[cell], [cell]
+        for nexts in reversed(steps):
+            cell = nexts[cell]
+            if cell is None:
+                break
+            cells.append(cell)
+        return cells, total
+
+    def _bitmask_path(self, values, size):
+        # Memoized on (cell, spheres left, collected mask): paths reaching the
+        # same cell with the same spheres share one subproblem. Only cells
+        # still in reach can matter, so the rest of the mask is dropped.
+        memo = {}
+        neighbors, reach = self.neighbors, self.reach
+        def extend(cell, mask, left):
+            key = (cell, left, mask & reach[left][cell])
+            if key not in memo:
+                gain, chosen = 0, None
+                if left:
+                    for neighbor in neighbors[cell]:
+                        bit = 1 << neighbor
+                        if not mask & bit:
+                            value = values[neighbor] + extend(neighbor, mask | bit, left - 1)
+                            if value > gain:
+                                gain, chosen = value, neighbor
+                memo[key] = gain, chosen
+            return memo[key][0]
+
+        length = min(self.max_length, size)
+        ceiling = sum(sorted(values, reverse=True)[:length])
+        start, total = 0, -1
+        for cell in range(size):
+            value = values[cell] + extend(cell, 1 << cell, length - 1)
+            if value > total:
+                start, total = cell, value
+                if total == ceiling:
+                    break
+        cells, cell, mask = [start], start, 1 << start
+        while True:
+            left = length - len(cells)
+            cell = memo[cell, left, mask & reach[left][cell]][1]
+            if cell is None:
+                return cells, total
+            mask |= 1 << cell
+            cells.append(cell)
+
 # --- CHARACTER CLASS (with enhancements) ---
 class Character:
     def __init__(self, name, attribute, hp, attack, defense, 
@@ -126,6 +355,7 @@ class Character:
                     attribute = attr_enum
                     break
         self.attribute = attribute
+        self.attribute_code = ATTRIBUTE_CODES.get(attribute, ATTRIBUTE_CODES[Attribute.RAINBOW])  # Unknown types are neutral, like RAINBOW
         
         self.max_hp = hp
         self.hp = hp
@@ -196,6 +426,7 @@ class Character:
         self.permanent_def_buff = 0
         self.dodge_chance = 0
         self.guard_chance = 0
+        self.behavior = None  # Compiled EnemyBehavior for scripted enemies
 
     # Getter/setter for Ki control
     @property
@@ -364,15 +595,11 @@ class Character:
     def is_alive(self): 
         return self.hp > 0
 
-    def use_active_skill(self, battle_system):
-        """Use active skill with battle context"""
-        if not self.active_skill:
-            return "No active skill available", 0
-        
-        if self.active_skill_used:
-            return "Active skill already used", 0
+    def can_use_active_skill(self, battle_system):
+        """Check active skill conditions without using it"""
+        if not self.active_skill or self.active_skill_used:
+            return False
         
-        # Check conditions
         condition_met = False
         if "Terrifying Zero Mortals Plan" in self.name:
             condition_met = battle_system.turn_count >= 4
@@ -391,8 +618,18 @@ class Character:
                 char for char in battle_system.player_team.rotation 
                 if char != self and Category.SUPER_BOSSES in char.categories
             )) or battle_system.turn_count >= 6
+        return condition_met
+
+    def use_active_skill(self, battle_system):
+        """Use active skill with battle context"""
+        if not self.active_skill:
+            return "No active skill available", 0
+        
+        if self.active_skill_used:
+            return "Active skill already used", 0
         
-        if not condition_met:
+        # Check conditions
+        if not self.can_use_active_skill(battle_system):
             return "Active skill conditions not met", 0
         
         self.active_skill_used = True
@@ -485,8 +722,8 @@ class Character:
 class Team:
     def __init__(self, is_player=False):
         self.members = []
-        self.rotation = []  # Current rotation (3 active characters)
-        self.reserve = []   # Characters in reserve
+        self.rotation = deque()  # Current rotation (3 active characters)
+        self.reserve = deque()   # Characters in reserve
         self.ki_graph = []
         self.is_player = is_player
         self.total_hp = 0
@@ -499,11 +736,11 @@ class Team:
     def setup_rotation(self):
         """Set up initial character rotation"""
         if len(self.members) < 3:
-            self.rotation = self.members.copy()
-            self.reserve = []
+            self.rotation = deque(self.members)
+            self.reserve = deque()
         else:
-            self.rotation = self.members[:3]
-            self.reserve = self.members[3:]
+            self.rotation = deque(self.members[:3])
+            self.reserve = deque(self.members[3:])
         
         for i, char in enumerate(self.rotation):
             char.rotation_position = i + 1
@@ -514,11 +751,11 @@ class Team:
             return
         
         # Move first character to reserve
-        char_out = self.rotation.pop(0)
+        char_out = self.rotation.popleft()
         self.reserve.append(char_out)
         
         # Add next character from reserve
-        char_in = self.reserve.pop(0)
+        char_in = self.reserve.popleft()
         self.rotation.append(char_in)
         
         # Update positions
@@ -568,43 +805,16 @@ class Team:
             return actual_damage
         return damage
 
-    def apply_leader_skill(self, leader):
+    def apply_leader_skill(self, leader, database=None):
         initial_max_hp = sum(m.max_hp for m in self.members)
 
-        # Reduced multipliers to more reasonable values
-        if "Dawn of an Ideal World" in leader.name:
-            for member in self.members:
-                if any(cat in [Category.WORLDWIDE_CHAOS, Category.POTARA] for cat in member.categories):
-                    # Reduced multipliers from 2.5 to 1.8
-                    member.max_hp *= 1.8; member.base_attack *= 1.8; member.base_defense *= 1.8; member.ki += 4
-        elif "Infinite Sanctuary" in leader.name:
-            for member in self.members:
-                if any(cat in [Category.REALM_OF_GODS, Category.WORLDWIDE_CHAOS, Category.FUSED_FIGHTERS] for cat in member.categories):
-                    # Reduced multipliers from 2.7 to 1.9
-                    member.max_hp *= 1.9; member.base_attack *= 1.9; member.base_defense *= 1.9; member.ki += 3
-                    if any(cat in [Category.TIME_TRAVELERS, Category.FINAL_TRUMP_CARD] for cat in member.categories):
-                         # Reduced multiplier from 1.3 to 1.1
-                         member.max_hp *= 1.1; member.base_attack *= 1.1; member.base_defense *= 1.1
-                elif not any(cat in [Category.REALM_OF_GODS, Category.WORLDWIDE_CHAOS, Category.FUSED_FIGHTERS] for cat in member.categories):
-                    # Reduced multiplier from 2.5 to 1.7
-                    member.max_hp *= 1.7; member.base_attack *= 1.7; member.base_defense *= 1.7; member.ki += 3
-        # Leader skills for new characters
-        elif "Rose Stained" in leader.name:
-            for member in self.members:
-                if any(cat in [Category.FUTURE_SAGA, Category.REALM_OF_GODS] for cat in member.categories):
-                    # Reduced multipliers from 3.0 to 2.0
-                    member.max_hp *= 2.0; member.base_attack *= 2.0; member.base_defense *= 1.8; member.ki += 4
-        elif "Mastery of the Power of Rage" in leader.name:
-            for member in self.members:
-                if any(cat in [Category.SUPER_BOSSES, Category.CORRODED_BODY] for cat in member.categories):
-                    # Reduced multipliers from 3.2 to 2.2
-                    member.max_hp *= 2.2; member.base_attack *= 2.2; member.base_defense *= 2.0; member.ki += 4
-        elif "Terrifying Zero Mortals Plan" in leader.name:
-            # Added leader skill for this character
-            for member in self.members:
-                if any(cat in [Category.FUTURE_SAGA, Category.REALM_OF_GODS, Category.SUPER_BOSSES] for cat in member.categories):
-                    member.max_hp *= 2.0; member.base_attack *= 2.0; member.base_defense *= 1.8; member.ki += 4
-        
+        # Multipliers come from LEADER_SKILL_DATABASE (or a tuning copy of it)
+        rules = get_leader_skill(leader, database)
+        for member in self.members:
+            for rule in rules:
+                if leader_rule_applies(rule, member.categories):
+                    member.max_hp *= rule["hp"]; member.base_attack *= rule["atk"]; member.base_defense *= rule["def"]; member.ki += rule["ki"]
+
         new_max_hp = sum(m.max_hp for m in self.members)
         for member in self.members:
             member.hp = member.max_hp
@@ -637,6 +847,283 @@ class Team:
             return self.total_hp > 0
         return any(member.is_alive() for member in self.members)
 
+# --- ROSTER INDEX ---
+class RosterIndex:
+    """Inverted index over a roster: Category, Attribute or link name -> bitset.
+
+    Bit i of a posting is set when roster unit i has that key. Queries combine
+    postings with plain int operations, so they stay fast on 10k+ units:
+
+        bits = index[Attribute.TEQ] & index[Category.REALM_OF_GODS] & index["Fused Fighter"]
+        units = index.members(bits)
+    """
+    def __init__(self, characters=None):
+        self.characters = []
+        self.postings = {}
+        self.universe = 0  # Bitset of all indexed units
+        for character in characters or []:
+            self.add(character)
+
+    def add(self, character):
+        """Index a character and return its roster id"""
+        unit_id = len(self.characters)
+        self.characters.append(character)
+        bit = 1 << unit_id
+        keys = [character.attribute, *character.categories, *character.links]
+        for key in set(keys):
+            self.postings[key] = self.postings.get(key, 0) | bit
+        self.universe |= bit
+        return unit_id
+
+    def __getitem__(self, key):
+        return self.postings.get(key, 0)
+
+    def __len__(self):
+        return len(self.characters)
+
+    def invert(self, bits):
+        """NOT: every indexed unit not in bits"""
+        return self.universe & ~bits
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """AND over all_of, OR over any_of, NOT over none_of. Returns a bitset."""
+        bits = self.universe
+        for key in all_of:
+            bits &= self.postings.get(key, 0)
+        if any_of:
+            union = 0
+            for key in any_of:
+                union |= self.postings.get(key, 0)
+            bits &= union
+        for key in none_of:
+            bits &= ~self.postings.get(key, 0)
+        return bits
+
+    def ids(self, bits):
+        """Sorted roster ids contained in a bitset"""
+        result = []
+        while bits:
+            low = bits & -bits
+            result.append(low.bit_length() - 1)
+            bits ^= low
+        return result
+
+    def members(self, bits):
+        return [self.characters[i] for i in self.ids(bits)]
+
+    @staticmethod
+    def count(bits):
+        return bin(bits).count("1")
+
+    def rule_eligible(self, rule):
+        """Bitset of units boosted by one LEADER_SKILL_DATABASE rule"""
+        bits = self.query(none_of=rule.get("none_of", []))
+        for group in rule.get("any_of", []):
+            bits &= self.query(any_of=group)
+        return bits
+
+    def leader_eligible(self, leader):
+        """Bitset of units boosted by at least one rule of the leader's skill"""
+        bits = 0
+        for rule in get_leader_skill(leader):
+            bits |= self.rule_eligible(rule)
+        return bits
+
+# --- ENEMY AI SCRIPTS ---
+# Example boss pattern: steady until half HP, then enraged and aiming at weaknesses
+VEGETA_RAGE_SCRIPT = {
+    "phases": [
+        {"hp_above": 0.5, "turns": [["normal", "normal", "super"]], "target": "random"},
+        {"hp_above": 0.0, "turns": [["super", "normal", "normal"], ["super", "super", "normal"]],
+         "target": "advantage"},
+    ],
+    "guaranteed_super": [1],
+}
+
+ENEMY_ACTIONS = {"normal": False, "super": True, "random": None}  # random = default AI chance
+
+def target_random(battle, attacker, players):
+    return random.choice(players)
+
+def target_first(battle, attacker, players):
+    return players[0]
+
+def target_last(battle, attacker, players):
+    return players[-1]
+
+def target_highest_atk(battle, attacker, players):
+    return max(players, key=lambda char: char.get_final_attack())
+
+def target_lowest_def(battle, attacker, players):
+    return min(players, key=lambda char: char.defense)
+
+def target_advantage(battle, attacker, players):
+    """The player the attacker's type hits hardest (first one on ties)"""
+    row = BattleSystem.TYPE_TABLE[attacker.attribute_code]
+    return max(players, key=lambda char: row[char.attribute_code])
+
+ENEMY_TARGET_RULES = {
+    "random": target_random,
+    "first": target_first,
+    "last": target_last,
+    "highest_atk": target_highest_atk,
+    "lowest_def": target_lowest_def,
+    "advantage": target_advantage,
+}
+
+class EnemyBehavior:
+    """Enemy script compiled into lookup tables.
+
+    A script has "phases", each with "hp_above" (HP fraction), "turns" (a
+    repeating cycle; each turn lists the action of the enemy's 1st, 2nd, 3rd
+    attack: "normal", "super" or "random") and a "target" rule from
+    ENEMY_TARGET_RULES. "guaranteed_super" lists battle turns where every
+    attack is a super. A script without "phases" is a single phase. During
+    the enemy phase only tuple indexing and a threshold scan remain.
+    """
+    def __init__(self, script):
+        self.script = script
+        compiled = []
+        for phase in script.get("phases") or [script]:
+            try:
+                table = tuple(tuple(ENEMY_ACTIONS[action] for action in turn)
+                              for turn in phase.get("turns", [["random"]]))
+                target = ENEMY_TARGET_RULES[phase.get("target", "random")]
+            except KeyError as error:
+                raise ValueError(f"Unknown enemy script entry: {error.args[0]}") from None
+            if not table or not all(table):
+                raise ValueError("Enemy script turns must not be empty")
+            compiled.append((phase.get("hp_above", 0.0), table, target))
+        compiled.sort(key=lambda phase: -phase[0])
+        self.phases = tuple(compiled)
+        self.guaranteed_super = frozenset(script.get("guaranteed_super", ()))
+    
+    def phase(self, enemy):
+        fraction = enemy.hp / enemy.max_hp if enemy.max_hp else 0
+        for phase in self.phases:
+            if fraction > phase[0]:
+                return phase
+        return self.phases[-1]
+    
+    def action(self, turn, enemy, attack_number):
+        """True for super, False for normal, None for the default AI chance"""
+        if turn in self.guaranteed_super:
+            return True
+        table = self.phase(enemy)[1]
+        row = table[(turn - 1) % len(table)]
+        return row[attack_number % len(row)]
+    
+    def target(self, battle, enemy, players):
+        return self.phase(enemy)[2](battle, enemy, players)
+
+# --- TIMED INPUT ---
+TIMEOUT_ANSWER = "!timeout"  # How a timed-out answer appears in a recorded script
+
+def console_input(prompt="", timeout=None):
+    """Keyboard input() that gives up after timeout seconds, returning None.
+    Piped (non-terminal) input has nobody to wait for and reads as usual."""
+    if timeout is None or not sys.stdin.isatty():
+        return builtins.input(prompt)
+    print(prompt, end="", flush=True)
+    if os.name == "nt":
+        import msvcrt
+        deadline = time.perf_counter() + timeout
+        typed = []
+        while time.perf_counter() < deadline:
+            while msvcrt.kbhit():
+                char = msvcrt.getwche()
+                if char in "\r\n":
+                    print()
+                    return "".join(typed)
+                typed.append(char)
+            time.sleep(0.005)
+        return None
+    ready, _, _ = select.select([sys.stdin], [], [], timeout)
+    if not ready:
+        import termios
+        termios.tcflush(sys.stdin, termios.TCIFLUSH)  # Drop a half-typed late answer
+        return None
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip("\n")
+
+class Console:
+    """Where the game reads answers and pauses: the keyboard. Scripted
+    replays, recordings and server sessions supply their own (see
+    use_console, BattleSystem.console)."""
+    def input(self, prompt="", timeout=None):
+        """An answer, or None if timeout seconds pass first"""
+        return console_input(prompt, timeout)
+    
+    def press_any_key(self):
+        builtins.input("\nPress Enter to continue...")  # A pause, not an answer: never recorded
+    
+    def clear_screen(self):
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+KEYBOARD = Console()
+_console_local = threading.local()
+
+def current_console():
+    """This thread's console: the one installed with use_console, else KEYBOARD"""
+    return getattr(_console_local, "console", None) or KEYBOARD
+
+@contextmanager
+def use_console(console):
+    """Read this thread's answers from console until exit; other threads are unaffected"""
+    previous = getattr(_console_local, "console", None)
+    _console_local.console = console
+    try:
+        yield console
+    finally:
+        _console_local.console = previous
+
+def ask(prompt="", timeout=None):
+    """input() through this thread's console"""
+    return current_console().input(prompt, timeout)
+
+# --- TYPE EFFECTIVENESS ---
+def dense_type_table(matrix):
+    """A {attacker: {defender: multiplier}} matrix as rows of multipliers,
+    indexed [attacker code][defender code]; missing pairs are 1.0"""
+    return tuple(tuple(matrix.get(attacker, {}).get(defender, 1.0) for defender in Attribute) for attacker in Attribute)
+
+def type_multipliers(attacker_codes, defender_codes, seed, table=None):
+    """Type multipliers, variance included, for arrays of attacker/defender
+    attribute codes (Character.attribute_code).
+
+    With numpy this is one fancy-index and one uniform draw for the whole
+    batch from numpy.random.default_rng(seed); without numpy it returns
+    array("d") drawn from random.Random(seed). Either way the same seed gives
+    the same multipliers and the game's own random state is untouched.
+    """
+    table = table or BattleSystem.TYPE_TABLE
+    low, high = BattleSystem.TYPE_VARIANCE
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy:
+        attackers = numpy.asarray(attacker_codes, dtype=numpy.intp)
+        defenders = numpy.asarray(defender_codes, dtype=numpy.intp)
+        rng = numpy.random.default_rng(seed)
+        return numpy.asarray(table)[attackers, defenders] * rng.uniform(low, high, attackers.shape)
+    uniform = random.Random(seed).uniform
+    return array("d", (table[attacker][defender] * uniform(low, high)
+                       for attacker, defender in zip(attacker_codes, defender_codes)))
+
+def type_chart(samples=200, seed=0):
+    """{(attacker, defender): (lowest, highest) multiplier seen in samples
+    hits} for every pair of sphere attributes that isn't neutral"""
+    pairs = [(attacker, defender) for attacker in KiBoard.SPHERE_ATTRIBUTES for defender in KiBoard.SPHERE_ATTRIBUTES
+             if BattleSystem.TYPE_TABLE[ATTRIBUTE_CODES[attacker]][ATTRIBUTE_CODES[defender]] != 1.0]
+    attackers = [ATTRIBUTE_CODES[attacker] for attacker, _ in pairs for _ in range(samples)]
+    defenders = [ATTRIBUTE_CODES[defender] for _, defender in pairs for _ in range(samples)]
+    multipliers = type_multipliers(attackers, defenders, seed)
+    return {pair: (min(multipliers[n * samples:(n + 1) * samples]), max(multipliers[n * samples:(n + 1) * samples]))
+            for n, pair in enumerate(pairs)}
+
 # --- BATTLE SYSTEM CLASS (with enhancements) ---
 class BattleSystem:
     TYPE_MATRIX = {
@@ -646,42 +1133,50 @@ class BattleSystem:
         Attribute.INT: {Attribute.TEQ: 1.5, Attribute.PHY: 0.8},
         Attribute.TEQ: {Attribute.AGL: 1.5, Attribute.INT: 0.8}
     }
+    TYPE_TABLE = dense_type_table(TYPE_MATRIX)  # [attacker code][defender code], see ATTRIBUTE_CODES
+    TYPE_VARIANCE = (0.95, 1.05)  # Every hit is scaled by a uniform draw from this range
+    STARTING_INVENTORY = {
+        SupportItem.GHOST_USHER: 2,
+        SupportItem.ANDROID_8: 2,
+        SupportItem.PRINCESS_SNAKE: 2,
+        SupportItem.WHIS: 2,
+    }
+    DOKKAN_SEQUENCE = ((0, 0), (0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0))  # Z-shaped trajectory
+    DOKKAN_POINT_SECONDS = 1.5  # Point i is due DOKKAN_POINT_SECONDS * i after the start
+    DOKKAN_PASS_RATE = 0.5
+    metrics = None  # MetricsRegistry shared by every battle, if set
+    console = None  # Console for answers and pauses; None reads through current_console()
+    ki_board = KiBoard()  # Assign a KiBoard on a battle (or subclass) for other grids
     
-    def __init__(self, player_team, enemy_team):
+    def __init__(self, player_team, enemy_team, console=None):
         self.player_team = player_team
         self.enemy_team = enemy_team
+        if console is not None:
+            self.console = console
         self.turn_count = 0
-        self.inventory = {
-            SupportItem.GHOST_USHER: 2,
-            SupportItem.ANDROID_8: 2,
-            SupportItem.PRINCESS_SNAKE: 2,
-            SupportItem.WHIS: 2,
-        }
+        self.inventory = dict(self.STARTING_INVENTORY)
         self.enemy_turn_delayed = False
         self.ghost_usher_active_this_battle = False
-        self.ki_grid = []  # 3x3 grid instead of linear field
+        self.ki_grid = []  # Rows of KiSphere, shaped by ki_board
         self.generate_ki_grid()
         self.player_team.setup_rotation()
         self.dokkan_available = False  # Dokkan Mode availability
         self.dokkan_character = None   # Character for Dokkan Mode
+        self.dokkan_log = []  # One entry per mini-game attempt, for analysis
+        self.fast_forward_policy = None  # BattlePolicy for fast-forward; None means GreedyItemPolicy
+        self.fast_forwarded = False
+        self.save_path = None  # Where "Save and quit" writes; None hides the option
+        self.checkpoint = None  # Save data from the start of the current round
+        self.quit_to_menu = False
 
     def generate_ki_grid(self):
-        """Generate 3x3 sphere grid"""
-        attributes = [Attribute.STR, Attribute.AGL, Attribute.TEQ, Attribute.INT, Attribute.PHY]
-        self.ki_grid = []
-        for _ in range(3):
-            row = []
-            for _ in range(3):
-                if random.random() < 0.1:
-                    row.append(KiSphere(Attribute.RAINBOW))
-                else:
-                    row.append(KiSphere(random.choice(attributes)))
-            self.ki_grid.append(row)
+        """Generate the sphere grid"""
+        self.ki_grid = self.ki_board.generate()
 
     def display_ki_grid(self):
         """Display sphere grid"""
         print("\n--- KI SPHERE GRID ---")
-        print("    0   1   2")
+        print("   " + "".join(f"{col:>4}" for col in range(len(self.ki_grid[0]))))
         for i, row in enumerate(self.ki_grid):
             print(f"{i} | {' | '.join(str(sphere) for sphere in row)} |")
         print("Legend: [S]STR(Red) [A]AGL(Blue) [T]TEQ(Green) [I]INT(Purple) [P]PHY(Orange) [R]Rainbow")
@@ -691,6 +1186,7 @@ class BattleSystem:
         self.display_battle_state()
         self.display_ki_grid()
         
+        board = self.ki_board
         collected_ki = 0
         collected_spheres = []
         
@@ -698,20 +1194,20 @@ class BattleSystem:
         print("Choose starting position (row, column):")
         
         try:
-            start_row = int(input("Row (0-2): "))
-            start_col = int(input("Column (0-2): "))
+            start_row = int(self.input(f"Row (0-{board.rows - 1}): "))
+            start_col = int(self.input(f"Column (0-{board.cols - 1}): "))
             
-            if not (0 <= start_row <= 2 and 0 <= start_col <= 2):
+            if not (0 <= start_row < board.rows and 0 <= start_col < board.cols):
                 print("Invalid position. Using random values.")
-                start_row, start_col = random.randint(0, 2), random.randint(0, 2)
+                start_row, start_col = random.randint(0, board.rows - 1), random.randint(0, board.cols - 1)
         except ValueError:
             print("Invalid input. Using random values.")
-            start_row, start_col = random.randint(0, 2), random.randint(0, 2)
+            start_row, start_col = random.randint(0, board.rows - 1), random.randint(0, board.cols - 1)
         
         current_row, current_col = start_row, start_col
         path_length = 0
         
-        while path_length < 7:
+        while path_length < board.max_length:
             # Collect sphere at current position
             if not self.ki_grid[current_row][current_col].collected:
                 sphere = self.ki_grid[current_row][current_col]
@@ -745,31 +1241,27 @@ class BattleSystem:
             print(f"Current Ki: +{collected_ki} (Total: {character.ki + collected_ki}/24)")
             print(f"Dokkan Counter: {self.player_team.dokkan_meter}/24")
             
-            if path_length >= 7:
+            if path_length >= board.max_length:
                 break
                 
             # Choose next direction
             print("\nChoose direction to continue:")
-            print("1. Right")
-            print("2. Down")
-            print("3. Down-right (diagonal)")
-            print("4. Finish collection")
+            for i, move in enumerate(board.moves, 1):
+                print(f"{i}. {board.move_name(move)}")
+            print(f"{len(board.moves) + 1}. Finish collection")
             
             try:
-                direction = int(input("Your choice: "))
-                if direction == 4:
+                direction = int(self.input("Your choice: "))
+                if direction == len(board.moves) + 1:
                     break
                 
                 # Determine new position
-                new_row, new_col = current_row, current_col
-                if direction == 1 and current_col < 2:  # Right
-                    new_col += 1
-                elif direction == 2 and current_row < 2:  # Down
-                    new_row += 1
-                elif direction == 3 and current_row < 2 and current_col < 2:  # Down-right
-                    new_row += 1
-                    new_col += 1
-                else:
+                if not 1 <= direction <= len(board.moves):
+                    print("Cannot move in that direction. Collection finished.")
+                    break
+                d_row, d_col = board.moves[direction - 1]
+                new_row, new_col = current_row + d_row, current_col + d_col
+                if not (0 <= new_row < board.rows and 0 <= new_col < board.cols):
                     print("Cannot move in that direction. Collection finished.")
                     break
                 
@@ -786,265 +1278,320 @@ class BattleSystem:
         self.press_any_key()
 
     def dokkan_mini_game(self, character):
-        """Mini-game for Dokkan Mode"""
+        """Mini-game for Dokkan Mode: each point has a hard deadline and its
+        reaction time is recorded in dokkan_log"""
         print("\n=== DOKKAN MODE ===")
         print(f"{character.name} prepares for a powerful attack!")
         print("Quickly trace a Z-shaped trajectory!")
         
-        # Z-shaped trajectory: 7 points
-        sequence = [
-            (0, 0), (0, 1), (0, 2),
-            (1, 2),
-            (2, 2), (2, 1), (2, 0)
-        ]
-        
+        sequence = self.DOKKAN_SEQUENCE
+        points = []
         success_count = 0
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         for i, (row, col) in enumerate(sequence):
-            print(f"\nPoint {i+1}/7: ({row}, {col})")
+            print(f"\nPoint {i+1}/{len(sequence)}: ({row}, {col})")
             print("Enter coordinates (row column):")
             
+            deadline = start_time + self.DOKKAN_POINT_SECONDS * (i + 1)
+            asked = time.perf_counter()
+            answer = self.input("", max(0.0, deadline - asked))
+            answered = time.perf_counter()
+            point = {"point": i + 1, "row": row, "col": col, "answer": answer,
+                     "latency": answered - asked, "hit": False, "timed_out": answer is None}
+            points.append(point)
+            if answer is None:
+                print("\nToo slow!")
+                break
+            
             try:
-                input_row, input_col = map(int, input().split())
+                input_row, input_col = map(int, answer.split())
                 if input_row == row and input_col == col:
                     success_count += 1
+                    point["hit"] = True
                     print("Success!")
                 else:
                     print("Miss!")
-            except:
+            except ValueError:
                 print("Invalid input!")
             
-            # Check time (max 1.5 seconds per point)
-            if time.time() - start_time > 1.5 * (i + 1):
+            # Piped input cannot be interrupted, so late answers still end the run
+            if answered > deadline:
                 print("Too slow!")
                 break
         
         # Calculate success rate
-        success_rate = success_count / 7
+        success_rate = success_count / len(sequence)
+        self.dokkan_log.append({"turn": self.turn_count, "character": character.name,
+                                "success_rate": success_rate, "points": points})
         print(f"\nSuccess rate: {success_rate:.0%}")
         
         if success_rate >= 0.7:
             print("Perfect execution! Powerful attack activated!")
             return True
-        elif success_rate >= 0.5:
+        elif success_rate >= self.DOKKAN_PASS_RATE:
             print("Good execution! Attack enhanced!")
             return True
         else:
             print("Failed execution! Attack not enhanced.")
             return False
 
-    def perform_attack(self, player_char):
-        """Perform attack with Dokkan Mode support"""
-        # Determine attack type based on Ki
-        attack_value = 0
-        attack_type = "Normal Attack"
+    def dokkan_rows(self):
+        """dokkan_log flattened to one row per point"""
+        for attempt in self.dokkan_log:
+            for point in attempt["points"]:
+                yield {"turn": attempt["turn"], "character": attempt["character"],
+                       "success_rate": attempt["success_rate"], **point}
+
+    def write_dokkan_csv(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=DOKKAN_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.dokkan_rows())
+
+    def alive_enemies(self):
+        return [enemy for enemy in self.enemy_team.members if enemy.is_alive()]
+
+    def start_character_turn(self, char_index):
+        """Everything before the action menu: reset buffs, new Ki grid,
+        passives, links, Ki collection. Returns the character."""
+        player_char = self.player_team.rotation[char_index]
+        player_char.start_turn_reset()
+        self.generate_ki_grid()  # A fresh grid for each character's turn
+        player_char.apply_passive_skills()
+        self.apply_links(char_index)
+        self.collect_ki_path(player_char)
+        player_char.ki += player_char.link_ki_buff
+        return player_char
+
+    def apply_links(self, char_index):
+        """Links the character shares with alive rotation allies"""
+        player_char = self.player_team.rotation[char_index]
+        active_links = set()
+        for i, ally in enumerate(self.player_team.rotation):
+            if i == char_index: continue
+            if not ally.is_alive(): continue
+            active_links.update(set(player_char.links) & set(ally.links))
+        if active_links:
+            player_char.apply_link_bonuses(active_links)
+            self.announce_links(player_char, active_links)
+
+    def strike(self, attacker, target, attack_value, effect="", can_crit=False):
+        """One hit: evasion, type multiplier, critical, damage and stun.
+        Returns None if evaded, else (type multiplier, damage before
+        defense, crit, damage taken). A critical hit replaces the stun."""
+        if target.try_evade():
+            return None
+        type_multiplier = self.type_multiplier(attacker, target)
+        final_damage = int(attack_value * type_multiplier)
+        crit = can_crit and attacker.try_critical()
+        if crit:
+            final_damage *= 1.5
+        if target.is_enemy:
+            damage = target.take_damage(final_damage)
+        else:
+            damage = self.player_team.take_damage(final_damage)  # Hits on players come out of the shared HP pool
+        if effect == "stun" and not crit:
+            target.status_effects[StatusEffect.STUN] = 1
+        return type_multiplier, final_damage, crit, damage
+
+    def perform_attack(self, player_char, target=None, dokkan=False):
+        """Attack with Dokkan Mode support. The Dokkan attack needs the
+        mini-game passed, else Ki picks Ultra/Super/normal. dokkan=True
+        skips asking whether to try it; target is asked for unless given."""
         effect = ""
+        can_dokkan = self.dokkan_available and self.dokkan_character == player_char
+        if can_dokkan and (dokkan or self.wants_dokkan(player_char)) and self.dokkan_mini_game(player_char):
+            attack_value, effect = player_char.dokkan_attack()
+            attack_type = "DOKKAN Attack"
+            self.dokkan_available = False
+            self.player_team.dokkan_meter = 0
+        elif player_char.ki >= 18 and player_char.is_lr:
+            attack_value, effect = player_char.ultra_super_attack()
+            attack_type = "Ultra Super Attack"
+            player_char.super_attacks_performed += 1
+            player_char.ki = 0
+        elif player_char.ki >= 12:
+            attack_value, effect = player_char.super_attack()
+            attack_type = "Super Attack"
+            player_char.super_attacks_performed += 1
+            player_char.ki = 0
+        else:
+            attack_value = player_char.normal_attack()
+            attack_type = "Normal Attack"
         
-        # Check Dokkan Mode availability
-        dokkan_attack = False
-        if self.dokkan_available and self.dokkan_character == player_char:
-            use_dokkan = input("Use Dokkan Mode? (y/n): ").lower() == 'y'
-            if use_dokkan:
-                dokkan_success = self.dokkan_mini_game(player_char)
-                if dokkan_success:
-                    attack_value, effect = player_char.dokkan_attack()
-                    attack_type = "DOKKAN Attack"
-                    self.dokkan_available = False
-                    self.player_team.dokkan_meter = 0
-        
-        if not dokkan_attack:
-            if player_char.ki >= 18 and player_char.is_lr:
-                attack_value, effect = player_char.ultra_super_attack()
-                attack_type = "Ultra Super Attack"
-                player_char.super_attacks_performed += 1
-                player_char.ki = 0
-            elif player_char.ki >= 12:
-                attack_value, effect = player_char.super_attack()
-                attack_type = "Super Attack"
-                player_char.super_attacks_performed += 1
-                player_char.ki = 0
-            else:
-                attack_value = player_char.normal_attack()
+        alive_enemies = self.alive_enemies()
+        if not alive_enemies: return
+        if target is None or not target.is_alive():
+            self.display_battle_state()
+            target = self.choose_target(player_char, alive_enemies)
+        hit = self.strike(player_char, target, attack_value, effect, can_crit=True)
+        self.report_hit(player_char, attack_type, target, hit, effect)
 
-        # Choose target
-        self.display_battle_state()
+    def perform_active_skill(self, player_char, target=None):
+        effect_message, effect_damage = player_char.use_active_skill(self)
+        self.announce_active_skill(player_char, effect_message)
+        alive_enemies = self.alive_enemies()
+        if effect_damage <= 0 or not alive_enemies:
+            self.report_hit(player_char, "Active Skill", None, None)
+            return
+        if target is None or not target.is_alive():
+            target = self.choose_target(player_char, alive_enemies)
+        effect = "stun" if "Dawn of an Ideal World" in player_char.name else ""
+        hit = self.strike(player_char, target, effect_damage, effect)
+        self.report_hit(player_char, "Active Skill", target, hit, effect)
+
+    # Decisions and output of the rules above; HeadlessBattleSystem overrides these
+    def announce_links(self, player_char, active_links):
+        print(f"\nActivated Links for {player_char.name}: {', '.join(active_links)}")
+        print(f"Bonuses: +{player_char.link_ki_buff} Ki, +{player_char.link_atk_buff}% ATK")
+        if player_char.link_evasion_buff > 0:
+            print(f"Evasion Bonus: +{player_char.link_evasion_buff}%")
+        self.press_any_key()
+
+    def wants_dokkan(self, player_char):
+        return self.input("Use Dokkan Mode? (y/n): ").lower() == 'y'
+
+    def choose_target(self, player_char, alive_enemies):
         print("\nChoose target:")
-        alive_enemies = {i: enemy for i, enemy in enumerate(self.enemy_team.members) if enemy.is_alive()}
-        if not alive_enemies: return
-        for i, enemy in alive_enemies.items():
+        by_index = {i: enemy for i, enemy in enumerate(self.enemy_team.members) if enemy in alive_enemies}
+        for i, enemy in by_index.items():
             print(f"{i}. {enemy.name} ({enemy.attribute.value}) | HP: {enemy.hp:,.0f}")
-        
         try:
-            target_index = int(input("Target: "))
-            if target_index in alive_enemies:
-                target = alive_enemies[target_index]
+            return by_index.get(int(self.input("Target: ")), alive_enemies[0])
+        except ValueError:
+            return alive_enemies[0]
+
+    def announce_active_skill(self, player_char, effect_message):
+        self.display_battle_state()
+        print(f"\n{effect_message}")
+
+    def report_stunned(self, attacker):
+        print(f"{attacker.name} is stunned and cannot attack!")
+
+    def report_hit(self, attacker, action, target, hit, effect="", slot=None):
+        """Show an attack resolved by strike(): hit is None if it was evaded,
+        target is None for an action that hit nobody; slot for enemy attacks"""
+        if target is None:
+            return
+        if action == "Active Skill":
+            if hit is None:
+                print(f"{target.name} evaded the active skill!")
+                return
+            print(f"Dealt {hit[3]:,.0f} damage!")
+            if not target.is_alive():
+                print(f"{target.name} defeated!")
+            if effect == "stun":
+                print(f"{target.name} is stunned for the next turn!")
+            return
+        
+        label = action
+        if attacker.is_enemy:  # Enemy super attacks are announced loudly
+            label = action.lower() if action == "Normal Attack" else action.upper()
+        if hit is None:
+            if attacker.is_enemy:
+                print(f"{target.name} evaded {attacker.name}'s {label}!")
             else:
-                target = next(iter(alive_enemies.values()))
-        except:
-            target = next(iter(alive_enemies.values()))
-            
-        # Check evasion
-        if target.try_evade():
-            print(f"{target.name} evaded the attack!")
+                print(f"{target.name} evaded the attack!")
             self.press_any_key()
             return
-            
-        # Calculate damage
-        type_multiplier = self.get_type_multiplier(player_char.attribute, target.attribute)
-        final_damage = int(attack_value * type_multiplier)
-        
-        # Check critical hit
-        critical = player_char.try_critical()
-        if critical:
-            final_damage *= 1.5
-            effect = "critical" if not effect else effect + ", critical"
+        type_multiplier, final_damage, crit, damage = hit
         
-        if target in self.player_team.members:
-            actual_damage = self.player_team.take_damage(final_damage)
-        else:
-            actual_damage = target.take_damage(final_damage)
-
         self.display_battle_state()
-        print(f"\n{player_char.name} uses {attack_type} on {target.name}!")
-        
+        if attacker.is_enemy:
+            print(f"\n{attacker.name} uses {label} on {target.name} (Slot {slot + 1})!")
+        else:
+            print(f"\n{attacker.name} uses {label} on {target.name}!")
         if type_multiplier > 1.2: 
             print("It's super effective!")
         elif type_multiplier < 1: 
             print("It's not very effective...")
-            
-        if critical:
+        if crit:
             print("CRITICAL HIT!")
-            
-        print(f"Total Damage: {final_damage:,.0f} | Actual Damage: {actual_damage:,.0f}")
-        
-        if effect == "stun":
+        if attacker.is_enemy:
+            print(f"Base Damage: {final_damage:,.0f} | Actual Damage: {damage:,.0f}")
+        else:
+            print(f"Total Damage: {final_damage:,.0f} | Actual Damage: {damage:,.0f}")
+        if effect == "stun" and not crit:
             print(f"{target.name} is stunned for the next turn!")
-            target.status_effects[StatusEffect.STUN] = 1
-        
-        if not target.is_alive(): 
+        if not attacker.is_enemy and not target.is_alive():
             print(f"{target.name} defeated!")
-        
         self.press_any_key()
 
-    def enemy_turn(self):
-        """Enemy turn with slot-based attacks"""
-        print("\n--- ENEMY'S TURN ---")
-        
-        # Determine attack order (3 slots)
-        attack_slots = []
+    def pick_attack_slots(self, count):
+        """Up to count attackers, as if every alive enemy's slots (1-3 each) were shuffled.
+
+        Samples slot numbers instead of building and shuffling the full slot
+        list, so big waves cost one pass over the enemies.
+        """
+        enemies = []
+        slot_ends = []
+        total = 0
         for enemy in self.enemy_team.members:
             if enemy.is_alive():
-                # Determine number of attacks for this enemy (1-3)
-                attacks = min(3, enemy.max_attacks_per_turn)
-                for _ in range(attacks):
-                    attack_slots.append(enemy)
-        
-        # Shuffle attacks
-        random.shuffle(attack_slots)
-        
+                total += min(3, enemy.max_attacks_per_turn)
+                enemies.append(enemy)
+                slot_ends.append(total)
+        return [enemies[bisect.bisect_right(slot_ends, slot)]
+                for slot in random.sample(range(total), min(count, total))]
+
+    def choose_enemy_target(self, attacker, alive_players):
+        """Target from the enemy's compiled script, or a random player"""
+        if attacker.behavior is None:
+            return random.choice(alive_players)
+        return attacker.behavior.target(self, attacker, alive_players)
+
+    def enemy_uses_super(self, attacker, slot, attack_number):
+        """Super or normal attack, from the enemy's script or the default AI"""
+        if attacker.behavior is not None:
+            action = attacker.behavior.action(self.turn_count, attacker, attack_number)
+            if action is not None:
+                return action
+        # Default AI: 30% super attack chance in the first slot, 10% in others
+        return random.random() < (0.3 if slot == 0 else 0.1)
+
+    def enemy_turn(self):
+        """Enemy turn with slot-based attacks"""
         # Execute up to 3 attacks
-        for i, attacker in enumerate(attack_slots[:3]):
+        attack_numbers = {}  # Attacks made by each enemy this turn
+        for i, attacker in enumerate(self.pick_attack_slots(3)):
             # Check for living players
             alive_players = [m for m in self.player_team.rotation if m.is_alive()]
             if not alive_players: 
                 return
             
-            # Choose random player
-            target_char = random.choice(alive_players)
+            # Choose target (scripted, or random player)
+            target_char = self.choose_enemy_target(attacker, alive_players)
+            attack_number = attack_numbers.get(attacker, 0)
+            attack_numbers[attacker] = attack_number + 1
             
             # Check for stun
             if StatusEffect.STUN in attacker.status_effects:
-                print(f"{attacker.name} is stunned and cannot attack!")
                 del attacker.status_effects[StatusEffect.STUN]
+                self.report_stunned(attacker)
                 continue
             
             # Determine attack type (normal or super)
-            is_super_attack = False
-            if i == 0:  # First slot can be super attack
-                is_super_attack = random.random() < 0.3  # 30% super attack chance
-            elif random.random() < 0.1:  # 10% chance in other slots
-                is_super_attack = True
-            
-            if is_super_attack:
-                # Use super attack if available, otherwise use ultra or normal
-                if hasattr(attacker, 'is_lr') and attacker.is_lr:
+            if self.enemy_uses_super(attacker, i, attack_number):
+                # Ultra super attack for LRs, super attack otherwise
+                if attacker.is_lr:
                     damage, effect = attacker.ultra_super_attack()
-                    attack_type = "ULTRA SUPER ATTACK"
+                    attack_type = "Ultra Super Attack"
                 else:
                     damage, effect = attacker.super_attack()
-                    attack_type = "SUPER ATTACK"
+                    attack_type = "Super Attack"
             else:
                 damage = attacker.normal_attack()
-                attack_type = "normal attack"
+                attack_type = "Normal Attack"
                 effect = ""
             
-            # Check evasion
-            if target_char.try_evade():
-                print(f"{target_char.name} evaded {attacker.name}'s {attack_type}!")
-                self.press_any_key()
-                continue
-                
-            # Calculate damage
-            type_multiplier = self.get_type_multiplier(attacker.attribute, target_char.attribute)
-            final_damage = int(damage * type_multiplier)
-            
-            # Account for defense effects
-            actual_damage = self.player_team.take_damage(final_damage)
-            
-            self.display_battle_state()
-            print(f"\n{attacker.name} uses {attack_type} on {target_char.name} (Slot {i+1})!")
-            
-            if type_multiplier > 1.2: 
-                print("It's super effective!")
-            elif type_multiplier < 1: 
-                print("It's not very effective...")
-                
-            print(f"Base Damage: {final_damage:,.0f} | Actual Damage: {actual_damage:,.0f}")
-            
-            # Apply stun effect
-            if effect == "stun":
-                print(f"{target_char.name} is stunned for the next turn!")
-                target_char.status_effects[StatusEffect.STUN] = 1
-            
-            self.press_any_key()
-
-            if not self.player_team.has_alive_members():
+            hit = self.strike(attacker, target_char, damage, effect)
+            self.report_hit(attacker, attack_type, target_char, hit, effect, slot=i)
+            if hit is not None and not self.player_team.has_alive_members():
                 return
 
     def player_character_turn(self, char_index):
-        player_char = self.player_team.rotation[char_index]
-        
-        # Reset temporary buffs
-        player_char.start_turn_reset()
-        
-        # Generate NEW ki grid for this character's turn
-        self.generate_ki_grid()  # ADDED: Reset grid for each character
-        
-        # Apply passive skills
-        player_char.apply_passive_skills()
-
-        # Activate Link Skills
-        active_links = set()
-        for i, ally in enumerate(self.player_team.rotation):
-            if i == char_index: continue
-            if not ally.is_alive(): continue
-            common_links = set(player_char.links) & set(ally.links)
-            active_links.update(common_links)
-        
-        if active_links:
-            player_char.apply_link_bonuses(active_links)
-            print(f"\nActivated Links for {player_char.name}: {', '.join(active_links)}")
-            print(f"Bonuses: +{player_char.link_ki_buff} Ki, +{player_char.link_atk_buff}% ATK")
-            if player_char.link_evasion_buff > 0:
-                print(f"Evasion Bonus: +{player_char.link_evasion_buff}%")
-            self.press_any_key()
-        
-        # Collect Ki from grid
-        self.collect_ki_path(player_char)
-        
-        # Add Ki from links (with limit)
-        player_char.ki += player_char.link_ki_buff
+        player_char = self.start_character_turn(char_index)
 
         # Action selection
         while True:
@@ -1071,9 +1618,26 @@ class BattleSystem:
                 action_index += 1
             else:
                 active_skill_option = -1
+            print("H. Hint (win chance of each action)")
+            print("F. Fast-forward (auto-play the rest of the battle)")
+            if self.save_path:
+                print("S. Save and quit (resumes from the start of this round)")
             
+            answer = self.input("Your choice: ").strip().lower()
+            if answer == "h":
+                self.show_hint(char_index)
+                continue
+            if answer == "f":
+                self.fast_forward(char_index)
+                return
+            if answer == "s" and self.save_path:
+                with open(self.save_path, "wb") as file:
+                    file.write(self.checkpoint)
+                print(f"Battle saved to {self.save_path}")
+                self.quit_to_menu = True
+                return
             try:
-                choice = int(input("Your choice: "))
+                choice = int(answer)
             except ValueError:
                 print("Invalid input. Please enter a number.")
                 continue
@@ -1083,101 +1647,9 @@ class BattleSystem:
                 continue
             
             if choice == active_skill_option:
-                effect_message, effect_damage = player_char.use_active_skill(self)
-                self.display_battle_state()
-                print(f"\n{effect_message}")
-                
-                if effect_damage > 0:
-                    # Active skill causes damage - need to choose target
-                    print("\nChoose target for active skill:")
-                    alive_enemies = {i: enemy for i, enemy in enumerate(self.enemy_team.members) if enemy.is_alive()}
-                    for i, enemy in alive_enemies.items():
-                        print(f"{i}. {enemy.name} ({enemy.attribute.value}) | HP: {enemy.hp:,.0f}")
-                    
-                    try:
-                        target_index = int(input("Target: "))
-                        if target_index in alive_enemies:
-                            target = alive_enemies[target_index]
-                        else:
-                            target = next(iter(alive_enemies.values()))
-                    except:
-                        target = next(iter(alive_enemies.values()))
-                    
-                    # Check evasion
-                    if target.try_evade():
-                        print(f"{target.name} evaded the active skill!")
-                    else:
-                        # Calculate damage
-                        type_multiplier = self.get_type_multiplier(player_char.attribute, target.attribute)
-                        final_damage = int(effect_damage * type_multiplier)
-                        actual_damage = target.take_damage(final_damage)
-                        
-                        print(f"Dealt {actual_damage:,.0f} damage!")
-                        if not target.is_alive():
-                            print(f"{target.name} defeated!")
-                        
-                        # Apply stun effect if applicable
-                        if "Dawn of an Ideal World" in player_char.name:
-                            print(f"{target.name} is stunned for the next turn!")
-                            target.status_effects[StatusEffect.STUN] = 1
-                
+                self.perform_active_skill(player_char)
                 self.press_any_key()
                 return
-                result = player_char.use_active_skill()
-                # Check for None and type
-                if isinstance(result, tuple): 
-                    damage, msg = result
-                elif isinstance(result, str): 
-                    msg = result
-                    damage = 0
-                else:
-                    msg = "No active skill available"
-                    damage = 0
-                
-                # Check availability
-                if "not available" in msg:
-                    print(msg)
-                    self.press_any_key()
-                    continue
-                
-                if "Lightning of Absolution" in msg:
-                    self.display_battle_state()
-                    print(f"\n{msg}")
-                    
-                    # Choose target for active skill
-                    print("\nChoose target:")
-                    alive_enemies = {i: enemy for i, enemy in enumerate(self.enemy_team.members) if enemy.is_alive()}
-                    for i, enemy in alive_enemies.items():
-                        print(f"{i}. {enemy.name} ({enemy.attribute.value}) | HP: {enemy.hp:,.0f}")
-                    
-                    try:
-                        target_index = int(input("Target: "))
-                        if target_index in alive_enemies:
-                            target = alive_enemies[target_index]
-                        else:
-                            target = next(iter(alive_enemies.values()))
-                    except:
-                        target = next(iter(alive_enemies.values()))
-                    
-                    # Check evasion
-                    if target.try_evade():
-                        print(f"{target.name} evaded the active skill!")
-                        self.press_any_key()
-                        return
-                    
-                    # Apply damage
-                    actual_damage = target.take_damage(damage)
-                    print(f"Dealt {actual_damage:,.0f} damage!")
-                    if not target.is_alive():
-                        print(f"{target.name} defeated!")
-                    self.press_any_key()
-                    return
-                
-                elif "Omnipresence" in msg:
-                    self.player_team.domain_active = True
-                    print(f"\n{msg}")
-                    self.press_any_key()
-                    return
             
             if choice == 1:
                 self.perform_attack(player_char)
@@ -1186,20 +1658,38 @@ class BattleSystem:
                 print("Invalid choice. Please select again.")
                 self.press_any_key()
 
-    @staticmethod
-    def clear_screen():
-        os.system('cls' if os.name == 'nt' else 'clear')
+    def show_hint(self, char_index):
+        """Win chance of each legal action, from headless rollouts"""
+        print("\nThinking...")
+        results = evaluate_actions(self, char_index)
+        self.display_battle_state()
+        print("\n--- HINT: WIN CHANCE BY ACTION ---")
+        for label, action, wins, played, (low, high) in results:
+            if played:
+                print(f"{label}: {wins / played:.0%} (95% CI {low:.0%}-{high:.0%}, {played} rollouts)")
+            else:
+                print(f"{label}: no rollouts in time")
+        self.press_any_key()
 
-    @staticmethod
-    def press_any_key():
-        input("\nPress Enter to continue...")
+    def input(self, prompt="", timeout=None):
+        return (self.console or current_console()).input(prompt, timeout)
+
+    def clear_screen(self):
+        (self.console or current_console()).clear_screen()
+
+    def press_any_key(self):
+        (self.console or current_console()).press_any_key()
 
     @staticmethod
     def get_type_multiplier(attacker_attr, defender_attr):
-        if attacker_attr in BattleSystem.TYPE_MATRIX:
-            multiplier = BattleSystem.TYPE_MATRIX[attacker_attr].get(defender_attr, 1.0)
-            return multiplier * random.uniform(0.95, 1.05)
-        return 1.0 * random.uniform(0.95, 1.05)
+        neutral = ATTRIBUTE_CODES[Attribute.RAINBOW]
+        multiplier = BattleSystem.TYPE_TABLE[ATTRIBUTE_CODES.get(attacker_attr, neutral)][ATTRIBUTE_CODES.get(defender_attr, neutral)]
+        return multiplier * random.uniform(*BattleSystem.TYPE_VARIANCE)
+
+    def type_multiplier(self, attacker, defender):
+        """Type multiplier for one hit, variance included"""
+        low, high = self.TYPE_VARIANCE
+        return self.TYPE_TABLE[attacker.attribute_code][defender.attribute_code] * (low + (high - low) * random.random())
 
     def update_turn_effects(self):
         self.enemy_turn_delayed = False
@@ -1235,7 +1725,7 @@ class BattleSystem:
         print(f"\n{cancel_option}. Cancel")
 
         try:
-            choice = int(input("\nChoose item to use: "))
+            choice = int(self.input("\nChoose item to use: "))
             if choice == cancel_option: 
                 return
             selected_item = available_items[choice-1]
@@ -1244,6 +1734,12 @@ class BattleSystem:
             self.press_any_key()
             return
             
+        message = self.apply_support_item(selected_item)
+        print(f"\n{message}")
+        self.press_any_key()
+
+    def apply_support_item(self, selected_item):
+        """Consume one item and apply its effect. Returns the effect message."""
         self.inventory[selected_item] -= 1
         message = f"Used {selected_item.value}! "
 
@@ -1270,9 +1766,7 @@ class BattleSystem:
             # CHANGED: Use unique key
             self.player_team.active_item_effects['damage_reduction_whis'] = {'value': 40, 'turns': 2}
             message += "Damage received reduced by 40% for 2 turns."
-            
-        print(f"\n{message}")
-        self.press_any_key()
+        return message
 
     def display_team(self, team, is_enemy):
         if is_enemy:
@@ -1320,18 +1814,92 @@ class BattleSystem:
                     print(f"{i+3}. {member.name} ({member.attribute.value}) | HP: {member.hp:,.0f}")
 
     def display_battle_state(self):
+        start = time.perf_counter()
         self.clear_screen()
         self.display_team(self.enemy_team, is_enemy=True)
         print("\n" + "=" * 80)
         self.display_team(self.player_team, is_enemy=False)
         print("\n" + "=" * 80)
         print(f"Turn: {self.turn_count}")
+        if self.metrics is not None:
+            self.metrics.record_render(time.perf_counter() - start)
 
-    def start_battle(self):
+    def load_stage(self, enemy_team):
+        """Next stage of an event: new enemies, everything else carries over"""
+        self.enemy_team = enemy_team
+        self.player_team.enemies = enemy_team.members
+        self.enemy_turn_delayed = False
+
+    def start_battle(self, fast_forward_policy=None):
+        """Play interactively; fast_forward_policy plays the rest if the player fast-forwards"""
         self.turn_count = 0
+        self.fast_forward_policy = fast_forward_policy
         self.player_team.setup_rotation()
+        self.resume_battle()
+
+    def resume_battle(self):
+        """Play on from the current state, e.g. a loaded save"""
+        self.fight()
+        if not self.quit_to_menu:
+            self.show_outcome()
+
+    def to_bytes(self):
+        """Compact save of the full battle state, RNG included (see SAVE FILES)"""
+        state = {key: value for key, value in vars(self).items() if key not in SAVE_EXCLUDED}
+        version, internal, gauss = random.getstate()
+        return pack_save({"battle": state, "rng": (version, array("I", internal).tobytes(), gauss)})
+
+    @classmethod
+    def from_bytes(cls, data, restore_rng=True):
+        state = unpack_save(data)
+        battle = cls.__new__(cls)
+        battle.__dict__.update(state["battle"])
+        battle.fast_forward_policy = None
+        battle.checkpoint = None
+        if restore_rng:
+            version, internal, gauss = state["rng"]
+            random.setstate((version, tuple(array("I", internal)), gauss))
+        return battle
+
+    def save(self, path):
+        data = self.to_bytes()
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)  # Never leave a half-written save behind
+
+    @classmethod
+    def load(cls, path, **options):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read(), **options)
+
+    def fast_forward(self, char_index):
+        """Auto-play the rest of the battle headlessly from this character's
+        action menu, then adopt the final state and print a summary"""
+        start = time.perf_counter()
+        first_turn = self.turn_count
+        headless = HeadlessBattleSystem.from_battle(self, self.fast_forward_policy or GreedyItemPolicy())
+        headless.play_out(char_index)
+        for key in list(vars(self)):
+            if key != "console":
+                setattr(self, key, getattr(headless, key))
+        self.fast_forwarded = True
         
+        print("\n--- FAST-FORWARD ---")
+        print(f"Rounds played: {self.turn_count - first_turn + 1} (now round {self.turn_count})")
+        print(f"Team HP: {self.player_team.total_hp:,} / {self.player_team.max_hp:,}")
+        for attack_type, damage in sorted(headless.damage_dealt.items(), key=lambda item: -item[1]):
+            print(f"{attack_type}: {int(damage):,} damage")
+        if not headless.is_finished():
+            print(f"No result after {headless.MAX_TURNS} rounds: counted as a defeat")
+        print(f"Resolved in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def fight(self):
+        """Play rounds until one side is defeated or the player fast-forwards"""
+        self.fast_forwarded = False
+        self.quit_to_menu = False
         while self.player_team.has_alive_members() and self.enemy_team.has_alive_members():
+            if self.save_path:
+                self.checkpoint = self.to_bytes()
             self.turn_count += 1
             self.update_turn_effects()
             
@@ -1343,6 +1911,7 @@ class BattleSystem:
                 if not self.enemy_team.has_alive_members(): break
                 if not self.player_team.rotation[i].is_alive(): continue
                 self.player_character_turn(i)
+                if self.fast_forwarded or self.quit_to_menu: return
             
             if not self.enemy_team.has_alive_members(): break
             
@@ -1361,38 +1930,3136 @@ class BattleSystem:
             if rotation_msg:
                 print("\n" + rotation_msg)
                 self.press_any_key()
-        
+
+    def show_outcome(self):
         self.display_battle_state()
-        if self.player_team.has_alive_members():
+        won = self.player_team.has_alive_members() and not self.enemy_team.has_alive_members()
+        if self.metrics is not None:
+            self.metrics.record_battle(won, self.turn_count)
+        if self.save_path and os.path.exists(self.save_path):
+            os.remove(self.save_path)  # The battle is over; nothing left to resume
+        if won:
             print("\n\n" + "="*30 + "\n" + " "*11 + "VICTORY!" + "\n" + "="*30)
         else:
             print("\n\n" + "="*30 + "\n" + " "*11 + "DEFEAT..." + "\n" + "="*30)
         
         self.press_any_key()
 
-# --- MAIN SECTION ---
-def main_menu():
-    while True:
-        BattleSystem.clear_screen()
-        print("Dokkan-Python v1.3")
+# --- HEADLESS SIMULATION ---
+ENGINE_VERSION = 3  # Bump when battle rules change; invalidates cached results
+KI_TABLE_EXACT_CELLS = 12  # Larger boards estimate the table from sampled grids
+KI_TABLE_SAMPLES = 20000
+_ki_yield_tables = {}
+
+class KiYieldTable:
+    """Distribution of the Ki one character collects per turn on a board,
+    walking the best path (2 Ki for a sphere of its attribute, 1 otherwise).
+
+    Cells are independent, so the best path only depends on which cells
+    match: boards of up to KI_TABLE_EXACT_CELLS cells enumerate every match
+    pattern for an exact table, larger ones sample grids.
+    super_turns/ultra_turns are the turns needed to reach 12/18 Ki from zero.
+    """
+    def __init__(self, board, attribute, seed=0):
+        self.attribute = attribute
+        match = board.sphere_chances().get(attribute, 0)
+        size = board.rows * board.cols
+        counts = {}
+        self.exact = size <= KI_TABLE_EXACT_CELLS
+        if self.exact:
+            for pattern in range(1 << size):
+                values = [1 + (pattern >> cell & 1) for cell in range(size)]
+                matches = bin(pattern).count("1")
+                ki = board.best_path(values)[1]
+                counts[ki] = counts.get(ki, 0) + match ** matches * (1 - match) ** (size - matches)
+        else:
+            rng = random.Random(seed)
+            for _ in range(KI_TABLE_SAMPLES):
+                ki = board.best_path([1 + (rng.random() < match) for _ in range(size)])[1]
+                counts[ki] = counts.get(ki, 0) + 1 / KI_TABLE_SAMPLES
+        total = sum(counts.values())
+        self.values = sorted(value for value in counts if counts[value] > 0)
+        self.chances = [counts[value] / total for value in self.values]
+        self.cumulative = list(itertools.accumulate(self.chances))
+        self.cumulative[-1] = 1.0
+        self.super_turns = self.turns_until(12)
+        self.ultra_turns = self.turns_until(18)
+    
+    @property
+    def mean(self):
+        return sum(value * chance for value, chance in zip(self.values, self.chances))
+    
+    def sample(self):
+        """One turn's Ki, drawn with the global random module"""
+        return self.values[bisect.bisect_right(self.cumulative, random.random())]
+    
+    def turns_until(self, threshold, bonus=0, start=0):
+        """[(turns, chance)] for reaching `threshold` Ki, gaining a table draw
+        plus `bonus` each turn"""
+        pending = {start: 1.0}  # Ki below threshold -> chance
+        turns = []
+        turn = 0
+        while pending:
+            turn += 1
+            reached = 0.0
+            following = {}
+            for ki, chance in pending.items():
+                for value, value_chance in zip(self.values, self.chances):
+                    total = ki + value + bonus
+                    if total >= threshold:
+                        reached += chance * value_chance
+                    else:
+                        following[total] = following.get(total, 0) + chance * value_chance
+            if reached:
+                turns.append((turn, reached))
+            pending = following
+        return turns
+
+def ki_yield_table(board, attribute):
+    """Cached KiYieldTable for a board's rules and a character attribute"""
+    key = (board.signature(), attribute)
+    table = _ki_yield_tables.get(key)
+    if table is None:
+        table = _ki_yield_tables[key] = KiYieldTable(board, attribute)
+    return table
+
+def ki_yield_tables(board=None):
+    """Precompute the tables of every sphere attribute: {Attribute: KiYieldTable}"""
+    board = board or BattleSystem.ki_board
+    return {attribute: ki_yield_table(board, attribute) for attribute in KiBoard.SPHERE_ATTRIBUTES}
+
+DOKKAN_FIELDS = ["turn", "character", "success_rate", "point", "row", "col", "answer", "latency", "hit", "timed_out"]
+
+class DokkanSkillModel:
+    """A simulated player at the Dokkan mini-game.
+
+    Each point is hit with probability hit_rate. Reaction times are
+    lognormal (median, sigma of the log), and the attempt stops at the first
+    point answered past its deadline, as the interactive game does.
+    """
+    def __init__(self, hit_rate=0.9, latency_median=0.8, latency_sigma=0.35):
+        self.hit_rate = hit_rate
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+    
+    def attempt(self):
+        """Success rate of one simulated attempt"""
+        sequence = BattleSystem.DOKKAN_SEQUENCE
+        elapsed = 0.0
+        hits = 0
+        for i in range(len(sequence)):
+            elapsed += random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+            if elapsed > BattleSystem.DOKKAN_POINT_SECONDS * (i + 1):
+                break
+            hits += random.random() < self.hit_rate
+        return hits / len(sequence)
+    
+    @classmethod
+    def fit(cls, rows):
+        """Estimate a model from exported mini-game rows (see write_dokkan_csv)"""
+        answered = [row for row in rows if str(row["timed_out"]) != "True"]
+        if not answered:
+            raise ValueError("No answered points to fit")
+        hit_rate = sum(str(row["hit"]) == "True" for row in answered) / len(answered)
+        logs = RunningStat()
+        for row in answered:
+            logs.add(math.log(max(float(row["latency"]), 1e-3)))
+        return cls(hit_rate, math.exp(logs.mean), logs.stdev or 0.35)
+    
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="") as file:
+            return cls.fit(list(csv.DictReader(file)))
+
+class BattlePolicy:
+    """Decisions for headless battles: attack, active skill when ready, no items"""
+    dokkan_skill = None  # DokkanSkillModel; None counts every mini-game as cleared
+    
+    def choose_item(self, battle, character):
+        return None  # SupportItem to use this character turn, or None
+
+    def use_active_skill(self, battle, character):
+        return True
+
+    def use_dokkan(self, battle, character):
+        return False  # The mini-game needs a player
+
+    def choose_target(self, battle, character, enemies):
+        return enemies[0]
+
+class HeadlessBattleSystem(BattleSystem):
+    """BattleSystem that plays itself with a policy: no rendering, no prompts"""
+    MAX_TURNS = 100
+    action_log = None  # Set to a list to collect per-action records (see BattleLogStore)
+    deadline = None  # time.perf_counter() value at which fight() gives up, leaving the battle unfinished
+    ki_tables = True  # Draw each turn's Ki from ki_yield_table(); False solves a generated grid
+    
+    def __init__(self, player_team, enemy_team, policy=None):
+        super().__init__(player_team, enemy_team)
+        self.policy = policy or BattlePolicy()
+        self.damage_dealt = {}  # attack_type -> total actual damage
+    
+    def clear_screen(self):
+        pass
+    
+    def press_any_key(self):
+        pass
+    
+    def display_battle_state(self):
+        pass
+    
+    def dokkan_mini_game(self, character):
+        skill = self.policy.dokkan_skill
+        return skill is None or skill.attempt() >= self.DOKKAN_PASS_RATE
+    
+    def generate_ki_grid(self):
+        if not self.ki_tables:
+            super().generate_ki_grid()
+    
+    def collect_ki_path(self, character):
+        """Collect spheres along the path with the most Ki"""
+        if self.ki_tables:
+            collected_ki = ki_yield_table(self.ki_board, character.attribute).sample()
+        else:
+            best_path, _ = self.ki_board.best_path(
+                [2 if sphere.attribute == character.attribute else 1 for row in self.ki_grid for sphere in row])
+            collected_ki = 0
+            for row, col in best_path:
+                sphere = self.ki_grid[row][col]
+                sphere.collected = True
+                collected_ki += 2 if sphere.attribute == character.attribute else 1
+        
+        self.player_team.dokkan_meter += collected_ki
+        if self.player_team.dokkan_meter >= 24 and not self.dokkan_available:
+            self.dokkan_available = True
+            self.dokkan_character = character
+        character.ki += collected_ki
+    
+    def record_damage(self, attack_type, damage):
+        self.damage_dealt[attack_type] = self.damage_dealt.get(attack_type, 0) + damage
+    
+    def log_action(self, actor, action, target=None, damage=0, crit=False, evaded=False, stunned=False, item=None):
+        """Append an ACTION_FIELDS record to action_log, if logging. HP after is
+        the target enemy's HP, or the team's HP pool for everything else.
+        Also reports the action to metrics, if set."""
+        if self.metrics is not None:
+            self.metrics.record_action("enemy" if actor and actor.is_enemy else "player", action,
+                                       damage, crit, evaded, stunned, item)
+        if self.action_log is None:
+            return
+        hp_after = target.hp if target is not None and target.is_enemy else self.player_team.total_hp
+        self.action_log.append((
+            self.turn_count, actor.name if actor else "Team", bool(actor and actor.is_enemy), action,
+            target.name if target else None, damage, crit, evaded, stunned, item, hp_after))
+    
+    def apply_support_item(self, item):
+        message = super().apply_support_item(item)
+        self.log_action(None, "Support Item", item=item.value)
+        return message
+    
+    def announce_links(self, player_char, active_links):
+        pass
+    
+    def wants_dokkan(self, player_char):
+        return self.policy.use_dokkan(self, player_char)
+    
+    def choose_target(self, player_char, alive_enemies):
+        return self.policy.choose_target(self, player_char, alive_enemies)
+    
+    def announce_active_skill(self, player_char, effect_message):
+        pass
+    
+    def report_stunned(self, attacker):
+        self.log_action(attacker, "Stunned")
+    
+    def report_hit(self, attacker, action, target, hit, effect="", slot=None):
+        if hit is None:
+            self.log_action(attacker, action, target, evaded=target is not None)
+            return
+        damage = hit[3]
+        if not attacker.is_enemy:
+            self.record_damage(action, damage)
+        self.log_action(attacker, action, target, damage, crit=hit[2], stunned=effect == "stun" and not hit[2])
+    
+    @classmethod
+    def from_battle(cls, battle, policy=None):
+        """Headless deep copy of a live battle, ready to continue from its state"""
+        headless = cls.__new__(cls)
+        console = battle.__dict__.get("console")
+        headless.__dict__.update(copy.deepcopy(battle.__dict__, {id(console): None}))  # Never copy a live console
+        headless.policy = policy or BattlePolicy()
+        headless.damage_dealt = {}
+        return headless
+    
+    @classmethod
+    def from_bytes(cls, data, policy=None, restore_rng=True):
+        battle = super().from_bytes(data, restore_rng)
+        battle.policy = policy or BattlePolicy()
+        battle.damage_dealt = battle.__dict__.get("damage_dealt", {})
+        return battle
+    
+    def player_character_turn(self, char_index):
+        player_char = self.start_character_turn(char_index)
+        item = self.policy.choose_item(self, player_char)
+        if item is not None and self.inventory.get(item, 0) > 0:
+            self.apply_support_item(item)
+        self.take_action(player_char)
+    
+    def take_action(self, player_char):
+        """Active skill when ready and wanted, otherwise attack"""
+        if (player_char.turn_count >= 4 and player_char.can_use_active_skill(self)
+                and self.policy.use_active_skill(self, player_char)):
+            self.perform_active_skill(player_char)
+            return
+        self.perform_attack(player_char)
+    
+    def perform_action(self, char_index, action):
+        """Play one action from legal_actions() for a rotation member whose
+        turn is at the action menu (links applied, Ki collected)"""
+        kind, argument = action
+        player_char = self.player_team.rotation[char_index]
+        if kind == "item":
+            self.apply_support_item(argument)  # Items don't end the turn
+            self.take_action(player_char)
+        elif kind == "active":
+            self.perform_active_skill(player_char, self.enemy_team.members[argument])
+        elif kind == "dokkan":
+            self.perform_attack(player_char, self.enemy_team.members[argument], dokkan=True)
+        else:
+            self.perform_attack(player_char, self.enemy_team.members[argument])
+    
+    def play_out(self, char_index, action=None):
+        """Finish the battle from a rotation member's action menu (links applied,
+        Ki collected): the given action or the policy's, then the remaining rounds"""
+        player_char = self.player_team.rotation[char_index]
+        if action is not None:
+            self.perform_action(char_index, action)
+        else:
+            item = self.policy.choose_item(self, player_char)
+            if item is not None and self.inventory.get(item, 0) > 0:
+                self.apply_support_item(item)
+            self.take_action(player_char)
+        self.play_round(char_index + 1)
+        self.fight()
+    
+    def play_round(self, first_index=0):
+        """One round: every rotation member acts, enemy acts, team rotates.
+        With first_index > 0, finish a round already in progress."""
+        if first_index == 0:
+            self.turn_count += 1
+            self.update_turn_effects()
+        
+        for i in range(first_index, len(self.player_team.rotation)):
+            if not self.enemy_team.has_alive_members(): break
+            if not self.player_team.rotation[i].is_alive(): continue
+            self.player_character_turn(i)
+        
+        if not self.enemy_team.has_alive_members(): return
+        
+        if self.enemy_turn_delayed:
+            self.enemy_turn_delayed = False
+        else:
+            self.enemy_turn()
+        self.player_team.rotate_team()
+    
+    def is_finished(self):
+        return not (self.player_team.has_alive_members() and self.enemy_team.has_alive_members())
+    
+    def result(self):
+        won = self.player_team.has_alive_members() and not self.enemy_team.has_alive_members()
+        return {
+            "win": won,
+            "turns": self.turn_count,
+            "team_hp": self.player_team.total_hp,
+            "team_hp_fraction": self.player_team.total_hp / self.player_team.max_hp if self.player_team.max_hp else 0,
+            "damage": dict(self.damage_dealt),
+        }
+    
+    def fight(self):
+        """Play rounds until this stage is decided, MAX_TURNS more rounds pass
+        or the deadline (if set) passes"""
+        last_turn = self.turn_count + self.MAX_TURNS
+        while not self.is_finished() and self.turn_count < last_turn:
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                return
+            self.play_round()
+    
+    def start_battle(self):
+        """Play to the end (or MAX_TURNS, counted as a loss) and return the result"""
+        start = time.perf_counter()
+        self.turn_count = 0
+        self.player_team.setup_rotation()
+        self.fight()
+        result = self.result()
+        if self.metrics is not None:
+            self.metrics.record_battle(result["win"], result["turns"], time.perf_counter() - start)
+        return result
+
+class TeamTemplate:
+    """Built teams (leader skill applied, links graph and rotation set up)
+    that stamp out fresh battle-ready copies.
+
+    Teams are deep-copied once. A stamp copies each character's and team's
+    attribute dict and only the containers a battle changes in place;
+    read-only data (links, categories, skill tables, ki graph, enemy
+    scripts) stays shared with the template. Cross-team references such as
+    Team.enemies point at the stamped characters.
+    """
+    CHARACTER_CONTAINERS = ("status_effects",)
+    
+    def __init__(self, *teams):
+        self.teams = copy.deepcopy(teams)
+        self.characters = []
+        slots = {}
+        for team in self.teams:
+            team.setup_rotation()
+            for member in team.members:
+                slots[id(member)] = len(self.characters)
+                self.characters.append(member)
+        self.layouts = [(
+            [slots[id(member)] for member in team.members],
+            [slots[id(member)] for member in team.rotation],
+            [slots[id(member)] for member in team.reserve],
+            [slots.get(id(enemy)) for enemy in team.enemies],
+        ) for team in self.teams]
+    
+    def stamp(self, classes=None):
+        """Fresh copies of the teams, in the order given. classes: one class
+        per character slot (e.g. a TurnCompiler's) to stamp into instead of
+        each character's own."""
+        containers = self.CHARACTER_CONTAINERS
+        fresh = []
+        for slot, character in enumerate(self.characters):
+            clone = Character.__new__(classes[slot] if classes else type(character))
+            state = character.__dict__.copy()
+            for name in containers:
+                state[name] = state[name].copy()
+            clone.__dict__ = state
+            fresh.append(clone)
+        
+        stamped = []
+        for team, (members, rotation, reserve, enemies) in zip(self.teams, self.layouts):
+            clone = Team.__new__(Team)
+            state = team.__dict__.copy()
+            state["members"] = [fresh[slot] for slot in members]
+            state["rotation"] = deque([fresh[slot] for slot in rotation])
+            state["reserve"] = deque([fresh[slot] for slot in reserve])
+            state["enemies"] = [team.enemies[i] if slot is None else fresh[slot] for i, slot in enumerate(enemies)]
+            state["active_item_effects"] = {name: dict(data) for name, data in team.active_item_effects.items()}
+            clone.__dict__ = state
+            stamped.append(clone)
+        return tuple(stamped)
+
+def simulate_battle(player_team, enemy_team, seed=None, policy=None):
+    """Play one headless battle on copies of the teams. A seeded battle
+    leaves the caller's random state as it found it."""
+    return simulate_template(TeamTemplate(player_team, enemy_team), seed, policy)
+
+def simulate_template(template, seed=None, policy=None):
+    """Play one headless battle on a fresh stamp of a (player, enemy)
+    TeamTemplate. A seeded battle leaves the caller's random state as it
+    found it."""
+    player_team, enemy_team = template.stamp()
+    if seed is None:
+        return HeadlessBattleSystem(player_team, enemy_team, policy).start_battle()
+    state = random.getstate()
+    try:
+        random.seed(seed)
+        return HeadlessBattleSystem(player_team, enemy_team, policy).start_battle()
+    finally:
+        random.setstate(state)
+
+def run_simulations(player_team, enemy_team, battles, seed=0, policy=None):
+    """Play battles with seeds seed..seed+battles-1 and summarize them"""
+    return simulate_stats(player_team, enemy_team, battles, seed, policy).summary()
+
+# --- TURN COMPILER ---
+def _adds(value):
+    """Whether `x += value` can change x (adding int 0 never does)"""
+    return value != 0 or isinstance(value, float)
+
+class TurnCompiler:
+    """Battle code specialized to one (player, enemy) setup, generated as
+    Python source and exec'd once.
+
+    Each character of the setup gets its own Character subclass: passive
+    skills, super attack effects, evasion and Ki table are constants in its
+    methods, and its links and type multipliers against every other
+    character are resolved into per-slot tables. CompiledBattle applies
+    links from bitmasks and looks type effectiveness up by slot. The
+    template is stamped into these classes (the template's own characters
+    are left alone), and results match HeadlessBattleSystem seed for seed.
+    """
+    LINK_EFFECTS = (LinkSkillEffect.KI, LinkSkillEffect.ATK_PERCENT, LinkSkillEffect.EVASION)
+    
+    def __init__(self, player_team, enemy_team):
+        self.template = TeamTemplate(player_team, enemy_team)
+        self.source = self.generate()
+        namespace = {
+            "Character": Character, "HeadlessBattleSystem": HeadlessBattleSystem,
+            "_random": random.random,
+            "_randrange": random.randrange,  # randint(1, n) draws the same as 1 + randrange(n)
+            "_bisect": bisect.bisect_right,
+        }
+        exec(compile(self.source, "<compiled turns>", "exec"), namespace)
+        self.classes = tuple(namespace[f"Slot{slot}"] for slot in range(len(self.template.characters)))
+        self.battle_class = namespace["CompiledBattle"]
+    
+    def simulate(self, seed=None, policy=None):
+        """Play one battle on a fresh stamp, like simulate_template: a seeded
+        battle leaves the caller's random state as it found it"""
+        player_team, enemy_team = self.template.stamp(self.classes)
+        if seed is None:
+            return self.battle_class(player_team, enemy_team, policy).start_battle()
+        state = random.getstate()
+        try:
+            random.seed(seed)
+            return self.battle_class(player_team, enemy_team, policy).start_battle()
+        finally:
+            random.setstate(state)
+    
+    def generate(self):
+        player_team = self.template.teams[0]
+        players = {id(member) for member in player_team.members}
+        parts = [self.character_source(slot, character, id(character) in players)
+                 for slot, character in enumerate(self.template.characters)]
+        parts.append(self.battle_source())
+        return "\n".join(parts)
+    
+    def link_tables(self, character):
+        """(mask per ally slot, {union mask: (ki, atk, evasion)}) for a player"""
+        bits = {}
+        masks = []
+        for ally in self.template.characters:
+            mask = 0
+            if ally is not character and ally in self.template.teams[0].members:
+                for name in set(character.links) & set(ally.links):
+                    if name in LINK_SKILL_DATABASE and LINK_SKILL_DATABASE[name][0] in self.LINK_EFFECTS:
+                        mask |= 1 << bits.setdefault(name, len(bits))
+            masks.append(mask)
+        names = sorted(bits, key=bits.get)
+        unions = {0}
+        for mask in masks:
+            unions |= {union | mask for union in unions}
+        totals = {}
+        for union in sorted(unions - {0}):
+            total = dict.fromkeys(self.LINK_EFFECTS, 0)
+            for name in names:
+                if union >> bits[name] & 1:
+                    effect, value = LINK_SKILL_DATABASE[name]
+                    total[effect] += value
+            totals[union] = tuple(total[effect] for effect in self.LINK_EFFECTS)
+        return tuple(masks), totals
+    
+    def character_source(self, slot, character, is_player):
+        passives = character.passive_skills
+        effects = character.super_attack_effects
+        table_row = BattleSystem.TYPE_TABLE[character.attribute_code]
+        type_row = tuple(table_row[other.attribute_code] for other in self.template.characters)
+        lines = [
+            f"class Slot{slot}(Character):",
+            f"    # {character.name!r}",
+            f"    slot = {slot}",
+            f"    type_row = {type_row!r}",
+        ]
+        if is_player:
+            link_masks, link_totals = self.link_tables(character)
+            lines += [f"    link_masks = {link_masks!r}", f"    link_totals = {link_totals!r}"]
+            if HeadlessBattleSystem.ki_tables:
+                table = ki_yield_table(HeadlessBattleSystem.ki_board, character.attribute)
+                lines += [f"    ki_values = {tuple(table.values)!r}", f"    ki_cumulative = {tuple(table.cumulative)!r}"]
+        
+        lines += ["", "    def apply_passive_skills(self):"]
+        for stat, key in (("attack", "base_atk"), ("defense", "base_def")):
+            if _adds(passives.get(key, 0)):
+                lines.append(f"        self.{stat} += {passives[key]!r}")
+        for buff, key, counter in (("permanent_atk_buff", "atk_per_super", "super_attacks_performed"),
+                                   ("permanent_def_buff", "def_per_super", "super_attacks_performed"),
+                                   ("permanent_atk_buff", "atk_per_attack_received", "attacks_received"),
+                                   ("permanent_def_buff", "def_per_attack_received", "attacks_received")):
+            if passives.get(key, 0) > 0:
+                lines.append(f"        self.{buff} += {passives[key]!r} * self.{counter}")
+        lines += ["        self.attack += self.permanent_atk_buff",
+                  "        self.defense += self.permanent_def_buff"]
+        for name, key in (("critical_hit_chance", "critical_hit_chance"), ("dodge_chance", "dodge_chance"),
+                          ("damage_reduction", "damage_reduction"), ("guard_chance", "guard_chance"),
+                          ("additional_attack_chance", "additional_attack")):
+            lines.append(f"        self.{name} = {passives.get(key, 0)!r}")
+        
+        for method, factor in (("super_attack", 2), ("ultra_super_attack", 3)):
+            lines += ["", f"    def {method}(self):",
+                      f"        base_attack = self.get_final_attack() * {factor}"]
+            if _adds(effects.get("atk_up", 0)):
+                lines.append(f"        self.atk_buff += {effects['atk_up']!r}")
+            if _adds(effects.get("def_up", 0)):
+                lines.append(f"        self.def_buff += {effects['def_up']!r}")
+            stun_chance = effects.get("stun_chance", 0)
+            if stun_chance > 0:
+                lines += [f"        if _randrange(100) + 1 <= {stun_chance!r}:",
+                          "            return base_attack, \"stun\""]
+            lines.append("        return base_attack, \"\"")
+        
+        lines += ["", "    def try_evade(self):",
+                  f"        total_evasion = {character.evasion.value!r} + self.link_evasion_buff + self.dodge_chance",
+                  "        if total_evasion <= 0:",
+                  "            return False",
+                  "        return _randrange(100) + 1 <= total_evasion", ""]
+        return "\n".join(lines)
+    
+    def battle_source(self):
+        low, high = BattleSystem.TYPE_VARIANCE  # As in BattleSystem.type_multiplier
+        lines = [
+            "class CompiledBattle(HeadlessBattleSystem):",
+            "    def type_multiplier(self, attacker, defender):",
+            f"        return attacker.type_row[defender.slot] * ({low!r} + {high - low!r} * _random())",
+            "",
+            "    def apply_links(self, char_index):",
+            "        rotation = self.player_team.rotation",
+            "        player_char = rotation[char_index]",
+            "        link_masks = player_char.link_masks",
+            "        mask = 0",
+            "        for i, ally in enumerate(rotation):",
+            "            if i != char_index and ally.hp > 0:",
+            "                mask |= link_masks[ally.slot]",
+            "        if mask:",
+            "            ki, atk, evasion = player_char.link_totals[mask]",
+            "            player_char.link_ki_buff += ki",
+            "            player_char.link_atk_buff += atk",
+            "            player_char.link_evasion_buff += evasion",
+            "",
+        ]
+        if HeadlessBattleSystem.ki_tables:
+            lines += [
+                "    def collect_ki_path(self, character):",
+                "        collected_ki = character.ki_values[_bisect(character.ki_cumulative, _random())]",
+                "        self.player_team.dokkan_meter += collected_ki",
+                "        if self.player_team.dokkan_meter >= 24 and not self.dokkan_available:",
+                "            self.dokkan_available = True",
+                "            self.dokkan_character = character",
+                "        character.ki += collected_ki",
+                "",
+            ]
+        return "\n".join(lines)
+
+def benchmark_compiled(player_team, enemy_team, battles=2000, seed=0, policy=None):
+    """Time the same seeded battles on HeadlessBattleSystem and a TurnCompiler
+    and check that both give the same results"""
+    template = TeamTemplate(player_team, enemy_team)
+    start = time.perf_counter()
+    generic = [simulate_template(template, battle_seed, policy) for battle_seed in range(seed, seed + battles)]
+    generic_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    compiler = TurnCompiler(player_team, enemy_team)
+    compile_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = [compiler.simulate(battle_seed, policy) for battle_seed in range(seed, seed + battles)]
+    compiled_seconds = time.perf_counter() - start
+    return {
+        "battles": battles,
+        "generic_seconds": generic_seconds,
+        "compiled_seconds": compiled_seconds,
+        "compile_seconds": compile_seconds,
+        "speedup": generic_seconds / compiled_seconds if compiled_seconds else 0.0,
+        "identical": generic == compiled,
+    }
+
+# --- SIMULATION STATISTICS ---
+class RunningStat:
+    """Constant-memory statistics for one measure.
+
+    Count, mean and variance (Welford), min/max, and a fixed-bucket histogram
+    over [low, high) with under/overflow buckets. The histogram gives
+    approximate quantiles. Buckets are linear, or logarithmic with log=True
+    (low must then be > 0). Stats with the same layout merge exactly.
+    """
+    def __init__(self, low=0.0, high=1.0, buckets=20, log=False):
+        self.low = low
+        self.high = high
+        self.log = log
+        self.counts = [0] * (buckets + 2)  # [underflow, buckets..., overflow]
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def _scale(self, value):
+        if self.log:
+            return math.log(value / self.low) / math.log(self.high / self.low)
+        return (value - self.low) / (self.high - self.low)
+    
+    def _unscale(self, position):
+        if self.log:
+            return self.low * (self.high / self.low) ** position
+        return self.low + position * (self.high - self.low)
+    
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+        
+        buckets = len(self.counts) - 2
+        if value < self.low:
+            self.counts[0] += 1
+        elif value >= self.high:
+            self.counts[-1] += 1
+        else:
+            self.counts[1 + min(int(self._scale(value) * buckets), buckets - 1)] += 1
+    
+    def merge(self, other):
+        """Fold another RunningStat with the same layout into this one"""
+        if (other.low, other.high, other.log, len(other.counts)) != (self.low, self.high, self.log, len(self.counts)):
+            raise ValueError("Cannot merge statistics with different histogram layouts")
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        return self
+    
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+    
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+    
+    def quantile(self, q):
+        """Approximate quantile, interpolated inside the histogram bucket"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        buckets = len(self.counts) - 2
+        seen = self.counts[0]
+        if target <= seen:
+            return self.min
+        for i in range(buckets):
+            count = self.counts[i + 1]
+            if count and seen + count >= target:
+                position = (i + (target - seen) / count) / buckets
+                return min(max(self._unscale(position), self.min), self.max)
+            seen += count
+        return self.max
+    
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "stdev": self.stdev,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+class SimulationStats:
+    """Streaming summary of headless battle results (see HeadlessBattleSystem.result)"""
+    def __init__(self):
+        self.battles = 0
+        self.wins = 0
+        max_turns = HeadlessBattleSystem.MAX_TURNS
+        self.turns = RunningStat(0, max_turns + 1, max_turns + 1)
+        self.win_turns = RunningStat(0, max_turns + 1, max_turns + 1)
+        self.team_hp = RunningStat(0.0, 1.0, 20)  # Fraction of team HP remaining
+        self.damage = {}  # attack_type -> damage per battle (battles where it was used)
+    
+    @staticmethod
+    def new_damage_stat():
+        return RunningStat(1.0, 1e9, 90, log=True)
+    
+    def add(self, result):
+        self.battles += 1
+        self.turns.add(result["turns"])
+        self.team_hp.add(result["team_hp_fraction"])
+        if result["win"]:
+            self.wins += 1
+            self.win_turns.add(result["turns"])
+        for attack_type, damage in result["damage"].items():
+            if attack_type not in self.damage:
+                self.damage[attack_type] = self.new_damage_stat()
+            self.damage[attack_type].add(damage)
+    
+    def merge(self, other):
+        self.battles += other.battles
+        self.wins += other.wins
+        self.turns.merge(other.turns)
+        self.win_turns.merge(other.win_turns)
+        self.team_hp.merge(other.team_hp)
+        for attack_type, stat in other.damage.items():
+            if attack_type not in self.damage:
+                self.damage[attack_type] = self.new_damage_stat()
+            self.damage[attack_type].merge(stat)
+        return self
+    
+    def summary(self):
+        return {
+            "battles": self.battles,
+            "wins": self.wins,
+            "win_rate": self.wins / self.battles if self.battles else 0.0,
+            "avg_turns": self.turns.mean if self.battles else 0.0,
+            "avg_win_turns": self.win_turns.mean if self.wins else None,
+            "turns": self.turns.summary(),
+            "team_hp": self.team_hp.summary(),
+            "damage": {attack_type: stat.summary() for attack_type, stat in self.damage.items()},
+        }
+
+def wilson_interval(wins, battles, z=1.96):
+    """Confidence interval for a win rate (Wilson score, 95% by default)"""
+    if battles == 0:
+        return 0.0, 1.0
+    rate = wins / battles
+    denominator = 1 + z * z / battles
+    center = (rate + z * z / (2 * battles)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / battles + z * z / (4 * battles * battles)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def simulate_stats(player_team, enemy_team, battles, seed=0, policy=None, workers=1, chunk_size=1000,
+                   compiled=False):
+    """Play battles (seeds seed..seed+battles-1) into a SimulationStats.
+
+    With workers > 1 the seed range is split into chunks; each worker
+    returns a SimulationStats for its chunk and the chunks are merged, so no
+    per-battle results are ever kept. compiled=True plays them with a
+    TurnCompiler (same results, less time per battle).
+    """
+    if workers <= 1:
+        stats = SimulationStats()
+        if compiled:
+            compiler = TurnCompiler(player_team, enemy_team)
+            for battle_seed in range(seed, seed + battles):
+                stats.add(compiler.simulate(battle_seed, policy))
+            return stats
+        template = TeamTemplate(player_team, enemy_team)
+        for battle_seed in range(seed, seed + battles):
+            stats.add(simulate_template(template, battle_seed, policy))
+        return stats
+    
+    starts = range(seed, seed + battles, chunk_size)
+    chunks = [(start, min(chunk_size, seed + battles - start)) for start in starts]
+    stats = SimulationStats()
+    for _, _, chunk in iter_chunk_stats(player_team, enemy_team, chunks, policy, workers, compiled):
+        stats.merge(chunk)
+    return stats
+
+def iter_chunk_stats(player_team, enemy_team, chunks, policy=None, workers=1, compiled=False):
+    """Yield (start, count, SimulationStats) for each (start, count) seed chunk"""
+    if workers <= 1:
+        for start, count in chunks:
+            yield start, count, simulate_stats(player_team, enemy_team, count, start, policy, compiled=compiled)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_simulation_worker,
+                             initargs=(player_team, enemy_team, policy, compiled)) as pool:
+        starts = [start for start, _ in chunks]
+        counts = [count for _, count in chunks]
+        for start, count, (chunk, metrics) in zip(starts, counts, pool.map(_simulate_chunk, starts, counts)):
+            if metrics is not None and BattleSystem.metrics is not None:
+                BattleSystem.metrics.merge(metrics)
+            yield start, count, chunk
+
+_simulation_setup = None
+
+def _init_simulation_worker(player_team, enemy_team, policy, compiled=False):
+    global _simulation_setup
+    _simulation_setup = (player_team, enemy_team, policy, compiled)
+
+def _simulate_chunk(start, count):
+    """The chunk's SimulationStats, plus its metrics if the parent collects them"""
+    player_team, enemy_team, policy, compiled = _simulation_setup
+    if BattleSystem.metrics is not None:  # Inherited from the parent: count this chunk alone and send it back
+        BattleSystem.metrics = MetricsRegistry(prefix=BattleSystem.metrics.prefix)
+    return simulate_stats(player_team, enemy_team, count, start, policy, compiled=compiled), BattleSystem.metrics
+
+# --- TELEMETRY ---
+METRICS_INTERVAL = 15.0  # Seconds between exports of a MetricsRegistry with a path
+TURN_BUCKETS = (1, 2, 3, 5, 8, 13, 20, 30, 50, 100)
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+def _label_text(names, values):
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}" if names else ""
+
+class Counter:
+    """Monotonic total per combination of label values"""
+    kind = "counter"
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # tuple of label values -> total
+    
+    def inc(self, amount=1, *label_values):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def samples(self):
+        """(name, label text, value) lines for the text format"""
+        return [(self.name, _label_text(self.labels, key), value) for key, value in sorted(self.values.items())]
+    
+    def merge(self, other):
+        for key, value in other.values.items():
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def snapshot(self):
+        if not self.labels:
+            return self.values.get((), 0)
+        return {"/".join(map(str, key)): value for key, value in sorted(self.values.items())}
+
+class Histogram:
+    """Cumulative-bucket histogram with fixed upper bounds, as Prometheus wants"""
+    kind = "histogram"
+    
+    def __init__(self, name, help, bounds):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last bucket: above every bound
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def merge(self, other):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+    
+    def cumulative(self):
+        return list(zip([*map(str, self.bounds), "+Inf"], itertools.accumulate(self.counts)))
+    
+    def samples(self):
+        lines = [(self.name + "_bucket", f'{{le="{bound}"}}', total) for bound, total in self.cumulative()]
+        return lines + [(self.name + "_count", "", self.count), (self.name + "_sum", "", self.sum)]
+    
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "buckets": dict(self.cumulative())}
+
+class MetricsRegistry:
+    """Counters and histograms for long-running simulation jobs and servers.
+
+    Assign one to BattleSystem.metrics: headless battles report every
+    action (through log_action) and every finished battle, interactive
+    battles report outcomes and screen render time. With a path, the
+    registry rewrites <path>.prom (Prometheus text format, e.g. for the node
+    exporter's textfile collector) and <path>.json at most every `interval`
+    seconds as battles finish; export() writes them on demand.
+    Metrics cover battles played in this process and, through merge(), the
+    simulate_stats workers it forks; only the process that created the
+    registry writes the files.
+    """
+    def __init__(self, path=None, interval=METRICS_INTERVAL, prefix="dokkan"):
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.next_export = time.monotonic() + interval
+        self.lock = threading.Lock()  # Server sessions report from several threads
+        self.export_lock = threading.Lock()  # Keeps the files in snapshot order
+        self.battles = Counter(f"{prefix}_battles_total", "Battles completed", ("result",))
+        self.turns = Histogram(f"{prefix}_battle_turns", "Rounds per completed battle", TURN_BUCKETS)
+        self.engine_seconds = Histogram(f"{prefix}_engine_seconds", "Time to play one headless battle", SECONDS_BUCKETS)
+        self.render_seconds = Histogram(f"{prefix}_render_seconds", "Time to draw one battle screen", SECONDS_BUCKETS)
+        self.actions = Counter(f"{prefix}_actions_total", "Actions taken", ("side", "action"))
+        self.damage = Counter(f"{prefix}_damage_total", "Damage dealt", ("side", "attack_type"))
+        self.evasions = Counter(f"{prefix}_evasions_total", "Attacks evaded, by attacking side", ("side",))
+        self.crits = Counter(f"{prefix}_crits_total", "Critical hits, by attacking side", ("side",))
+        self.stuns = Counter(f"{prefix}_stuns_total", "Stuns landed, by attacking side", ("side",))
+        self.items = Counter(f"{prefix}_items_used_total", "Support items used", ("item",))
+        self.metrics = [self.battles, self.turns, self.engine_seconds, self.render_seconds, self.actions,
+                        self.damage, self.evasions, self.crits, self.stuns, self.items]
+    
+    def record_action(self, side, action, damage=0, crit=False, evaded=False, stunned=False, item=None):
+        with self.lock:
+            self.actions.inc(1, side, action)
+            if damage:
+                self.damage.inc(damage, side, action)
+            if crit:
+                self.crits.inc(1, side)
+            if evaded:
+                self.evasions.inc(1, side)
+            if stunned:
+                self.stuns.inc(1, side)
+            if item is not None:
+                self.items.inc(1, item)
+    
+    def record_battle(self, won, turns, seconds=None):
+        with self.lock:
+            self.battles.inc(1, "win" if won else "loss")
+            self.turns.observe(turns)
+            if seconds is not None:
+                self.engine_seconds.observe(seconds)
+            due = self.export_due()
+        if due:
+            self.export()
+    
+    def export_due(self):
+        """Whether to export now (call with the lock held); claims the slot, so only one caller exports"""
+        if self.path is None or time.monotonic() < self.next_export:
+            return False
+        self.next_export = time.monotonic() + self.interval
+        return True
+    
+    def record_render(self, seconds):
+        with self.lock:
+            self.render_seconds.observe(seconds)
+    
+    def text(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "uptime_seconds": time.time() - self.started,
+                "metrics": {metric.name: metric.snapshot() for metric in self.metrics},
+            }
+    
+    def merge(self, other):
+        """Add another registry's counts (e.g. a worker's) into this one"""
+        with self.lock:
+            for mine, theirs in zip(self.metrics, other.metrics):
+                mine.merge(theirs)
+            due = self.export_due()
+        if due:
+            self.export()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"], state["export_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+    
+    def export(self):
+        """Atomically rewrite <path>.prom and <path>.json"""
+        if os.getpid() != self.pid:
+            return  # A forked worker's copy; the files belong to the parent
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self.export_lock:
+            with self.lock:
+                self.next_export = time.monotonic() + self.interval
+            for suffix, content in ((".prom", self.text()), (".json", json.dumps(self.snapshot(), indent=2))):
+                descriptor, temporary = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(self.path + suffix) + ".",
+                                                         dir=directory)
+                try:
+                    with os.fdopen(descriptor, "w") as file:
+                        file.write(content)
+                    os.chmod(temporary, 0o644)  # mkstemp makes it private; collectors need to read it
+                    os.replace(temporary, self.path + suffix)
+                except BaseException:
+                    os.unlink(temporary)
+                    raise
+
+# --- SAMPLING PROFILER ---
+PROFILE_INTERVAL = 0.01  # Seconds between stack samples
+PROFILE_PHASES = {  # Innermost of these on the stack names the battle phase
+    "generate_ki_grid": "ki_collection", "collect_ki_path": "ki_collection",
+    "perform_attack": "attack", "perform_active_skill": "attack", "take_action": "attack",
+    "enemy_turn": "enemy_turn",
+    "display_battle_state": "render", "display_ki_grid": "render", "display_team": "render",
+    "rotate_team": "rotation",
+    "player_character_turn": "player_turn", "update_turn_effects": "round_start",
+}
+
+class SamplingProfiler:
+    """Statistical profiler for long simulation runs.
+
+    A daemon thread wakes every `interval` seconds and records the target
+    thread's stack (code objects only; labels are built once when writing),
+    so the cost is one short GIL hold per sample whatever the battle does.
+    Each sample is tagged with its battle phase, read off the stack with
+    PROFILE_PHASES, so the engine needs no instrumentation. write() emits
+    collapsed stacks ("phase;outer;...;inner count") for flamegraph.pl,
+    speedscope or inferno.
+    """
+    def __init__(self, interval=PROFILE_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.counts = {}  # Tuple of code objects, outermost first -> samples
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def start(self):
+        """Sample the calling thread (or thread_id) until stop()"""
+        self.thread_id = self.thread_id or threading.get_ident()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    
+    def run(self):
+        counts = self.counts
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            counts[stack] = counts.get(stack, 0) + 1
+            self.samples += 1
+    
+    @staticmethod
+    def phase(stack):
+        for code in reversed(stack):
+            phase = PROFILE_PHASES.get(code.co_name)
+            if phase:
+                return phase
+        return "other"
+    
+    def phase_totals(self):
+        """{phase: samples}"""
+        totals = {}
+        for stack, count in self.counts.items():
+            phase = self.phase(stack)
+            totals[phase] = totals.get(phase, 0) + count
+        return totals
+    
+    def collapsed(self):
+        """Collapsed-stack lines, phase as the root frame"""
+        labels = {}
+        def label(code):
+            if code not in labels:
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                labels[code] = name.replace(";", ":")
+            return labels[code]
+        merged = {}
+        for stack, count in self.counts.items():
+            line = ";".join([self.phase(stack), *map(label, stack)])
+            merged[line] = merged.get(line, 0) + count
+        return [f"{line} {count}" for line, count in sorted(merged.items())]
+    
+    def write(self, path):
+        with open(path, "w") as file:
+            file.write("\n".join(self.collapsed()) + "\n")
+
+# --- SIMULATION CACHE ---
+def canonical_state(obj):
+    """JSON-ready, order-independent form of teams, characters and policies"""
+    if isinstance(obj, Enum):
+        return f"{type(obj).__name__}.{obj.name}"
+    if isinstance(obj, dict):
+        items = [(canonical_state(key), canonical_state(value)) for key, value in obj.items()]
+        return {"dict": sorted(items, key=lambda item: json.dumps(item[0], sort_keys=True))}
+    if isinstance(obj, (set, frozenset)):
+        return {"set": sorted((canonical_state(item) for item in obj), key=json.dumps)}
+    if isinstance(obj, (list, tuple, deque)):
+        return [canonical_state(item) for item in obj]
+    if isinstance(obj, (bytes, bytearray)):
+        return {"bytes": hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, EnemyBehavior):
+        return {"EnemyBehavior": canonical_state(obj.script)}
+    if isinstance(obj, (Character, Team, BattlePolicy, DokkanSkillModel)):
+        return {type(obj).__name__: canonical_state(vars(obj))}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    raise TypeError(f"Cannot canonicalize {type(obj).__name__}")
+
+def scenario_hash(player_team, enemy_team, policy=None):
+    """Stable hash of everything that decides a battle except the seed"""
+    scenario = {
+        "engine": ENGINE_VERSION,
+        "player": canonical_state(player_team),
+        "enemy": canonical_state(enemy_team),
+        "policy": canonical_state(policy or BattlePolicy()),
+        "inventory": canonical_state(HeadlessBattleSystem.STARTING_INVENTORY),
+        "max_turns": HeadlessBattleSystem.MAX_TURNS,
+        "ki_board": HeadlessBattleSystem.ki_board.signature(),
+        "ki_tables": HeadlessBattleSystem.ki_tables,
+    }
+    return hashlib.sha256(json.dumps(scenario, sort_keys=True).encode()).hexdigest()
+
+class SimulationCache:
+    """SQLite-backed cache of SimulationStats per scenario and seed chunk.
+
+    Seeds are stored in CHUNK_SIZE-aligned chunks, one row per chunk start
+    holding however many of its seeds have been played. Asking for more
+    battles of a known scenario only simulates the seeds not stored yet: a
+    partly played chunk is topped up and its row replaced. Each chunk is
+    committed as soon as it is done, so an interrupted run keeps its
+    progress. Stats are stored pickled: only open cache files you trust.
+    """
+    CHUNK_SIZE = 1000
+    
+    def __init__(self, path="dokkan_cache.sqlite3"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS seed_chunks ("
+            "scenario TEXT NOT NULL, start INTEGER NOT NULL, count INTEGER NOT NULL, "
+            "stats BLOB NOT NULL, PRIMARY KEY (scenario, start))")
+        self.connection.commit()
+    
+    def close(self):
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def split(self, seed, battles):
+        """Seed range -> (start, count) chunks on CHUNK_SIZE boundaries"""
+        chunks = []
+        start, end = seed, seed + battles
+        while start < end:
+            boundary = (start // self.CHUNK_SIZE + 1) * self.CHUNK_SIZE
+            chunks.append((start, min(boundary, end) - start))
+            start = min(boundary, end)
+        return chunks
+    
+    def stats(self, player_team, enemy_team, battles, seed=0, policy=None, workers=1):
+        """SimulationStats for seeds seed..seed+battles-1, simulating only what's missing"""
+        scenario = scenario_hash(player_team, enemy_team, policy)
+        stats = SimulationStats()
+        missing = []
+        stored = {}  # Start of seeds to simulate -> (chunk start, chunk count, stored stats or None)
+        for start, count in self.split(seed, battles):
+            row = self.connection.execute(
+                "SELECT count, stats FROM seed_chunks WHERE scenario = ? AND start = ?",
+                (scenario, start)).fetchone()
+            if row and row[0] == count:
+                stats.merge(pickle.loads(row[1]))
+            elif row and row[0] < count:  # Partly played: only the rest of the seeds
+                missing.append((start + row[0], count - row[0]))
+                stored[start + row[0]] = (start, count, pickle.loads(row[1]))
+            elif row:  # The stored row covers more seeds than asked for; keep it
+                missing.append((start, count))
+            else:
+                missing.append((start, count))
+                stored[start] = (start, count, None)
+        
+        for start, count, chunk in iter_chunk_stats(player_team, enemy_team, missing, policy, workers):
+            if start in stored:
+                chunk_start, chunk_count, previous = stored[start]
+                if previous is not None:
+                    previous.merge(chunk)
+                    chunk = previous
+                self.connection.execute("INSERT OR REPLACE INTO seed_chunks VALUES (?, ?, ?, ?)",
+                                        (scenario, chunk_start, chunk_count, pickle.dumps(chunk)))
+                self.connection.commit()
+            stats.merge(chunk)
+        return stats
+
+# --- BATTLE LOG STORE ---
+ACTION_FIELDS = ["turn", "actor", "enemy", "action", "target", "damage", "crit", "evaded", "stunned", "item", "hp_after"]
+
+class BattleLogStore:
+    """SQLite store of per-battle and per-action records for analysis.
+
+    Rows are buffered and written BATCH_SIZE at a time with executemany in
+    one transaction, with WAL journaling and synchronous=NORMAL, so logging
+    keeps up with the simulator. Actor, action, target and item strings are
+    interned in a names table and stored as ids; the action_log view joins
+    them back for ad-hoc queries. Battle ids are assigned here instead of
+    read back from SQLite, and actions repeats the scenario id so
+    per-scenario queries need no join. Query helpers flush pending rows.
+    """
+    BATCH_SIZE = 50000
+    
+    def __init__(self, path="dokkan_log.sqlite3"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS scenarios (id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL, label TEXT);"
+            "CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS battles (id INTEGER PRIMARY KEY, scenario INTEGER NOT NULL, "
+            "seed INTEGER, win INTEGER, turns INTEGER, team_hp REAL);"
+            "CREATE TABLE IF NOT EXISTS actions (battle INTEGER NOT NULL, scenario INTEGER NOT NULL, "
+            "turn INTEGER, actor INTEGER, enemy INTEGER, action INTEGER, target INTEGER, damage REAL, "
+            "crit INTEGER, evaded INTEGER, stunned INTEGER, item INTEGER, hp_after REAL);"
+            "CREATE INDEX IF NOT EXISTS battles_scenario ON battles (scenario, win);"
+            "CREATE INDEX IF NOT EXISTS actions_scenario_turn ON actions (scenario, turn);"
+            "CREATE INDEX IF NOT EXISTS actions_actor ON actions (actor);"
+            "CREATE VIEW IF NOT EXISTS action_log AS SELECT a.battle, a.scenario, a.turn, "
+            "actor.name AS actor, a.enemy, action.name AS action, target.name AS target, a.damage, "
+            "a.crit, a.evaded, a.stunned, item.name AS item, a.hp_after FROM actions a "
+            "LEFT JOIN names actor ON actor.id = a.actor LEFT JOIN names action ON action.id = a.action "
+            "LEFT JOIN names target ON target.id = a.target LEFT JOIN names item ON item.id = a.item;")
+        self.name_ids = {name: id for id, name in self.connection.execute("SELECT id, name FROM names")}
+        self.name_ids[None] = None
+        self.next_battle = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM battles").fetchone()[0]
+        self.names = []
+        self.battles = []
+        self.actions = []
+    
+    def close(self):
+        self.flush()
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def scenario(self, player_team, enemy_team, policy=None, label=None):
+        """Id of a scenario, keyed by scenario_hash"""
+        key = scenario_hash(player_team, enemy_team, policy)
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO scenarios (hash, label) VALUES (?, ?)", (key, label))
+        return self.connection.execute("SELECT id FROM scenarios WHERE hash = ?", (key,)).fetchone()[0]
+    
+    def name_id(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None and name is not None:
+            name_id = self.name_ids[name] = len(self.name_ids)  # Ids start at 1: None holds a slot
+            self.names.append((name_id, name))
+        return name_id
+    
+    def add(self, scenario, seed, result, actions):
+        """Buffer one battle: its result dict and ACTION_FIELDS records"""
+        battle = self.next_battle
+        self.next_battle += 1
+        self.battles.append((battle, scenario, seed, result["win"], result["turns"], result["team_hp"]))
+        ids = self.name_ids
+        name_id = self.name_id
+        rows = self.actions
+        for turn, actor, enemy, action, target, damage, crit, evaded, stunned, item, hp_after in actions:
+            rows.append((battle, scenario, turn, ids.get(actor) or name_id(actor), enemy,
+                         ids.get(action) or name_id(action), ids.get(target) or name_id(target),
+                         damage, crit, evaded, stunned, ids.get(item) or name_id(item), hp_after))
+        if len(rows) >= self.BATCH_SIZE:
+            self.flush()
+    
+    def flush(self):
+        if not self.battles and not self.actions and not self.names:
+            return
+        with self.connection:
+            self.connection.executemany("INSERT INTO names VALUES (?, ?)", self.names)
+            self.connection.executemany("INSERT INTO battles VALUES (?, ?, ?, ?, ?, ?)", self.battles)
+            self.connection.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.actions)
+        self.names.clear()
+        self.battles.clear()
+        self.actions.clear()
+    
+    def query(self, sql, params=()):
+        self.flush()
+        return self.connection.execute(sql, params).fetchall()
+    
+    def damage_by_turn(self, scenario):
+        """(turn, action, average damage, count) for the player side"""
+        return self.query(
+            "SELECT a.turn, n.name, AVG(a.damage), COUNT(*) FROM actions a JOIN names n ON n.id = a.action "
+            "WHERE a.scenario = ? AND a.enemy = 0 AND a.damage > 0 GROUP BY a.turn, n.name ORDER BY a.turn, n.name",
+            (scenario,))
+    
+    def loss_turns(self, scenario):
+        """(turn, losses) histogram of the turn on which battles were lost"""
+        return self.query(
+            "SELECT turns, COUNT(*) FROM battles WHERE scenario = ? AND win = 0 GROUP BY turns ORDER BY turns",
+            (scenario,))
+    
+    def actor_summary(self, scenario):
+        """(actor, actions, total damage, crit rate, evaded rate) per actor"""
+        return self.query(
+            "SELECT n.name, COUNT(*), SUM(a.damage), AVG(a.crit), AVG(a.evaded) FROM actions a "
+            "JOIN names n ON n.id = a.actor WHERE a.scenario = ? GROUP BY a.actor ORDER BY SUM(a.damage) DESC",
+            (scenario,))
+
+def log_simulations(store, player_team, enemy_team, battles, seed=0, policy=None, label=None):
+    """Play battles like simulate_stats, recording each battle and action in
+    store (a BattleLogStore or TraceWriter). Returns (scenario id, SimulationStats)."""
+    scenario = store.scenario(player_team, enemy_team, policy, label)
+    template = TeamTemplate(player_team, enemy_team)
+    stats = SimulationStats()
+    state = random.getstate()  # Seeding per battle must not leak into the caller
+    try:
+        for battle_seed in range(seed, seed + battles):
+            battle_player, battle_enemy = template.stamp()
+            random.seed(battle_seed)
+            battle = HeadlessBattleSystem(battle_player, battle_enemy, policy)
+            battle.action_log = []
+            result = battle.start_battle()
+            stats.add(result)
+            store.add(scenario, battle_seed, result, battle.action_log)
+    finally:
+        random.setstate(state)
+    store.flush()
+    return scenario, stats
+
+# --- TRACE EXPORT ---
+TRACE_VERSION = 1
+TRACE_DTYPES = {"B": "u1", "H": "u2", "I": "u4", "q": "i8", "f": "f4"}  # array typecode -> NumPy dtype
+TRACE_TABLES = {
+    "battles": [("battle", "I"), ("scenario", "H"), ("seed", "q"), ("win", "B"), ("turns", "H"), ("team_hp", "f")],
+    "actions": [("battle", "I"), ("scenario", "H"), ("turn", "H"), ("actor", "H"), ("action", "H"),
+                ("target", "H"), ("item", "H"), ("damage", "f"), ("hp_after", "f"), ("flags", "B")],
+}
+TRACE_FLAGS = {"enemy": 1, "crit": 2, "evaded": 4, "stunned": 8}
+
+class TraceWriter:
+    """Columnar export of battle traces for very large campaigns.
+
+    Each column of each table is a file of fixed-dtype little-endian values
+    at directory/<table>/<column>.bin. schema.json holds dtypes, committed row
+    counts, the names table (actor/action/target/item ids; 0 is none) and
+    scenarios. Columns are buffered in arrays and appended every BATCH_ROWS
+    rows; the schema is rewritten after each flush, so a reader never sees
+    a half-written batch. Same sink interface as BattleLogStore, and an
+    existing directory is appended to (after dropping any batch the schema
+    never committed).
+    """
+    BATCH_ROWS = 100000
+    SCHEMA_FILE = "schema.json"
+    
+    def __init__(self, directory):
+        self.directory = directory
+        path = os.path.join(directory, self.SCHEMA_FILE)
+        if os.path.exists(path):
+            with open(path) as file:
+                schema = json.load(file)
+            if schema["version"] != TRACE_VERSION or schema["byteorder"] != "little":
+                raise ValueError(f"{directory} holds traces this version cannot append to")
+            self.rows = {table: schema["tables"][table]["rows"] for table in TRACE_TABLES}
+            self.names = schema["names"]
+            self.scenarios = schema["scenarios"]
+        else:
+            self.rows = {table: 0 for table in TRACE_TABLES}
+            self.names = [None]
+            self.scenarios = []
+        self.name_ids = {name: id for id, name in enumerate(self.names)}
+        self.columns = {table: {name: array(code) for name, code in columns}
+                        for table, columns in TRACE_TABLES.items()}
+        self.next_battle = self.rows["battles"] + 1
+        self.pending = 0
+        for table, columns in TRACE_TABLES.items():
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+            for name, code in columns:
+                path = os.path.join(directory, table, name + ".bin")
+                size = self.rows[table] * array(code).itemsize
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)  # A batch cut off before its schema was written
+    
+    def close(self):
+        self.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def scenario(self, player_team, enemy_team, policy=None, label=None):
+        key = scenario_hash(player_team, enemy_team, policy)
+        for index, scenario in enumerate(self.scenarios):
+            if scenario["hash"] == key:
+                return index
+        self.scenarios.append({"hash": key, "label": label})
+        return len(self.scenarios) - 1
+    
+    def name_id(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+    
+    def add(self, scenario, seed, result, actions):
+        """Buffer one battle: its result dict and ACTION_FIELDS records"""
+        battle = self.next_battle
+        self.next_battle += 1
+        columns = self.columns["battles"]
+        columns["battle"].append(battle)
+        columns["scenario"].append(scenario)
+        columns["seed"].append(seed)
+        columns["win"].append(result["win"])
+        columns["turns"].append(result["turns"])
+        columns["team_hp"].append(result["team_hp"])
+        
+        columns = self.columns["actions"]
+        battles, scenarios, turns = columns["battle"].append, columns["scenario"].append, columns["turn"].append
+        actors, kinds, targets = columns["actor"].append, columns["action"].append, columns["target"].append
+        items, damages, hps, flags = columns["item"].append, columns["damage"].append, columns["hp_after"].append, columns["flags"].append
+        ids, name_id = self.name_ids, self.name_id
+        for turn, actor, enemy, action, target, damage, crit, evaded, stunned, item, hp_after in actions:
+            battles(battle)
+            scenarios(scenario)
+            turns(turn)
+            actors(ids.get(actor) or name_id(actor))
+            kinds(ids.get(action) or name_id(action))
+            targets(ids.get(target) or name_id(target))
+            items(ids.get(item) or name_id(item))
+            damages(damage)
+            hps(hp_after)
+            flags(enemy | crit << 1 | evaded << 2 | stunned << 3)
+        self.pending += len(actions) + 1
+        if self.pending >= self.BATCH_ROWS:
+            self.flush()
+    
+    def flush(self):
+        for table, columns in self.columns.items():
+            for name, values in columns.items():
+                if sys.byteorder != "little":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                with open(os.path.join(self.directory, table, name + ".bin"), "ab") as file:
+                    values.tofile(file)
+            self.rows[table] += len(columns[TRACE_TABLES[table][0][0]])
+            for values in columns.values():
+                del values[:]
+        self.pending = 0
+        
+        schema = {
+            "version": TRACE_VERSION,
+            "byteorder": "little",
+            "tables": {table: {"rows": self.rows[table],
+                               "columns": [{"name": name, "dtype": "<" + TRACE_DTYPES[code], "typecode": code}
+                                           for name, code in columns]}
+                       for table, columns in TRACE_TABLES.items()},
+            "flags": TRACE_FLAGS,
+            "names": self.names,
+            "scenarios": self.scenarios,
+        }
+        path = os.path.join(self.directory, self.SCHEMA_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(schema, file)
+        os.replace(path + ".tmp", path)
+
+class TraceReader:
+    """Memory-mapped, zero-copy access to a TraceWriter directory.
+
+    column() returns a NumPy array over the mapped file when NumPy is
+    installed, otherwise a typed memoryview; either way nothing is copied
+    or turned into Python objects until it is indexed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, TraceWriter.SCHEMA_FILE)) as file:
+            self.schema = json.load(file)
+        if self.schema["version"] > TRACE_VERSION:
+            raise ValueError(f"Trace format {self.schema['version']} is newer than this reader")
+        self.names = self.schema["names"]
+        self.scenarios = self.schema["scenarios"]
+        self.maps = []
+    
+    def close(self):
+        """Unmap every column; views from column() must be released first"""
+        maps, self.maps = self.maps, []
+        for mapped in maps:
+            mapped.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def rows(self, table):
+        return self.schema["tables"][table]["rows"]
+    
+    def column(self, table, name):
+        spec = self.schema["tables"][table]
+        column = next(column for column in spec["columns"] if column["name"] == name)
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if spec["rows"] == 0:
+            return numpy.empty(0, column["dtype"]) if numpy else memoryview(array(column["typecode"]))
+        with open(os.path.join(self.directory, table, name + ".bin"), "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(mapped)
+        if numpy:
+            return numpy.frombuffer(mapped, column["dtype"], count=spec["rows"])
+        if self.schema["byteorder"] != sys.byteorder:
+            raise ValueError("Reading foreign byte order needs NumPy")
+        size = array(column["typecode"]).itemsize
+        return memoryview(mapped)[:spec["rows"] * size].cast(column["typecode"])
+    
+    def table(self, table):
+        """{column name: view} for every column of a table"""
+        return {column["name"]: self.column(table, column["name"]) for column in self.schema["tables"][table]["columns"]}
+    
+    def name_id(self, name):
+        return self.names.index(name)
+
+# --- STAGED EVENTS ---
+def boss_rush_stages(count, wave_size=1, growth=1.05, script=None):
+    """Lazily generate count stages: waves of wave_size Vegetas sharing the
+    boss's HP, with stats growing by `growth` each stage. A script (see
+    EnemyBehavior) is compiled once and shared by every enemy."""
+    behavior = EnemyBehavior(script) if script else None
+    for stage in range(count):
+        scale = growth ** stage
+        enemy_team = Team()
+        for n in range(wave_size):
+            vegeta = create_vegeta_team().members[0]
+            if wave_size > 1:
+                vegeta.name = f"{vegeta.name} #{n + 1}"
+            vegeta.max_hp = vegeta.hp = vegeta.max_hp * scale / wave_size
+            vegeta.base_attack = vegeta.attack = vegeta.base_attack * scale
+            vegeta.behavior = behavior
+            # Waves can be bigger than a player team, so skip add_member's cap
+            enemy_team.members.append(vegeta)
+        yield enemy_team
+
+def run_gauntlet(player_team, stages, seed=None, policy=None):
+    """Headless staged event: one team fights each stage in order.
+
+    Stages are pulled from the iterable one at a time. Team HP, Ki,
+    rotation, items, timed effects and the Dokkan meter carry over.
+    Returns the battle result plus stages_cleared; win means every stage
+    was cleared. A seeded run leaves the caller's random state as it found
+    it.
+    """
+    player_team = copy.deepcopy(player_team)
+    state = random.getstate()
+    if seed is not None:
+        random.seed(seed)
+    battle = None
+    cleared = 0
+    try:
+        for enemy_team in stages:
+            if battle is None:
+                battle = HeadlessBattleSystem(player_team, enemy_team, policy)
+            else:
+                battle.load_stage(enemy_team)
+            battle.fight()
+            if not battle.is_finished() or not player_team.has_alive_members():
+                break  # Defeated, or stalled for MAX_TURNS
+            cleared += 1
+        else:
+            result = battle.result() if battle else {"turns": 0, "damage": {}}
+            result.update(win=True, stages_cleared=cleared)
+            return result
+    finally:
+        if seed is not None:
+            random.setstate(state)
+    result = battle.result()
+    result.update(win=False, stages_cleared=cleared)
+    return result
+
+def start_event(player_team, stages):
+    """Interactive staged event: the same team fights each stage in order"""
+    battle = None
+    for number, enemy_team in enumerate(stages, 1):
+        if battle is None:
+            battle = BattleSystem(player_team, enemy_team)
+        else:
+            battle.load_stage(enemy_team)
+        battle.display_battle_state()
+        print(f"\n=== STAGE {number} ===")
+        battle.press_any_key()
+        battle.fight()
+        if battle.quit_to_menu:
+            return
+        # Ask the battle, not player_team: fast-forwarding swaps in the headless copies.
+        # A stage still standing (e.g. a fast-forward out of rounds) ends the event too.
+        if not battle.player_team.has_alive_members() or battle.enemy_team.has_alive_members():
+            break
+    if battle:
+        battle.show_outcome()
+
+# --- SUPPORT ITEM POLICY ---
+ITEM_ORDER = [SupportItem.GHOST_USHER, SupportItem.ANDROID_8, SupportItem.PRINCESS_SNAKE, SupportItem.WHIS]
+
+class RandomItemPolicy(BattlePolicy):
+    """Baseline: at the start of a round, use a random item with some chance"""
+    def __init__(self, chance=0.3):
+        self.chance = chance
+    
+    def choose_item(self, battle, character):
+        if character is not battle.player_team.rotation[0] or random.random() >= self.chance:
+            return None
+        available = [item for item in ITEM_ORDER if battle.inventory.get(item, 0) > 0]
+        return random.choice(available) if available else None
+
+class GreedyItemPolicy(BattlePolicy):
+    """Baseline: heal as soon as team HP drops under a threshold"""
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+    
+    def choose_item(self, battle, character):
+        team = battle.player_team
+        if character is not team.rotation[0] or team.total_hp >= team.max_hp * self.threshold:
+            return None
+        for item in (SupportItem.ANDROID_8, SupportItem.PRINCESS_SNAKE, SupportItem.WHIS):
+            if battle.inventory.get(item, 0) > 0:
+                return item
+        return None
+
+class ItemPolicy(BattlePolicy):
+    """Support items from a solved lookup table (see solve_item_policy).
+
+    One decision per round, made on the first rotation member's turn. The
+    state is team HP bin, round, remaining inventory, whether Whis and
+    Android #8 effects carry into this round and whether Ghost Usher was
+    used. It maps to one byte: 0 for no item, else 1 + ITEM_ORDER index.
+    """
+    FILE_MAGIC = b"DOKKAN-ITEMS"
+    
+    def __init__(self, table, hp_bins, horizon, max_count):
+        self.table = table
+        self.hp_bins = hp_bins
+        self.horizon = horizon
+        self.max_count = max_count
+    
+    def state_index(self, round_index, hp_bin, counts, whis_on, android_on, ghost_used):
+        index = round_index * self.hp_bins + hp_bin
+        for count in counts:
+            index = index * (self.max_count + 1) + count
+        return ((index * 2 + whis_on) * 2 + android_on) * 2 + ghost_used
+    
+    def choose_item(self, battle, character):
+        team = battle.player_team
+        if character is not team.rotation[0]:
+            return None
+        round_index = min(max(battle.turn_count, 1), self.horizon) - 1
+        hp_bin = min(int(team.total_hp / team.max_hp * self.hp_bins), self.hp_bins - 1)
+        counts = [min(battle.inventory.get(item, 0), self.max_count) for item in ITEM_ORDER]
+        action = self.table[self.state_index(
+            round_index, hp_bin, counts,
+            'damage_reduction_whis' in team.active_item_effects,
+            'def_boost_android8' in team.active_item_effects,
+            battle.ghost_usher_active_this_battle)]
+        return ITEM_ORDER[action - 1] if action else None
+    
+    def save(self, path):
+        header = json.dumps({"hp_bins": self.hp_bins, "horizon": self.horizon, "max_count": self.max_count})
+        with open(path, "wb") as file:
+            file.write(self.FILE_MAGIC + b"\n" + header.encode() + b"\n")
+            file.write(self.table)
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            if file.readline().rstrip(b"\n") != cls.FILE_MAGIC:
+                raise ValueError(f"{path} is not an item policy file")
+            header = json.loads(file.readline())
+            return cls(bytearray(file.read()), header["hp_bins"], header["horizon"], header["max_count"])
+
+def enemy_damage_distribution(player_team, enemy_team, samples=2000, seed=0, buckets=100):
+    """Histogram of one enemy turn's damage as a fraction of team max HP,
+    before item effects: list of (fraction, probability).
+
+    Every sample is an enemy turn on a fresh stamp of the teams, so buffs
+    from earlier samples don't carry over; the caller's random state is
+    left as it was found.
+    """
+    template = TeamTemplate(player_team, enemy_team)
+    state = random.getstate()
+    random.seed(seed)
+    counts = {}
+    try:
+        for sample in range(samples):
+            player_team, enemy_team = template.stamp()
+            battle = HeadlessBattleSystem(player_team, enemy_team)
+            battle.turn_count = sample % 10 + 1  # Cover scripted turn cycles
+            player_team.total_hp = player_team.max_hp * 1000  # Never dies while sampling
+            before = player_team.total_hp
+            battle.enemy_turn()
+            fraction = (before - player_team.total_hp) / player_team.max_hp
+            bucket = min(int(fraction * buckets), buckets)  # Last bucket: a full team wipe or more
+            counts[bucket] = counts.get(bucket, 0) + 1
+    finally:
+        random.setstate(state)
+    return [((bucket + 0.5) / buckets, count / samples) for bucket, count in sorted(counts.items())]
+
+def solve_item_policy(damage_distribution, hp_bins=20, horizon=15, inventory=None):
+    """Backward dynamic programming over the ItemPolicy state space.
+
+    Maximizes the chance the team survives `horizon` rounds, given the enemy
+    damage distribution per round (see enemy_damage_distribution). Heals,
+    damage reduction and DEF boosts follow BattleSystem.apply_support_item
+    and Team.take_damage. The policy uses at most one item per round.
+    """
+    inventory = inventory or BattleSystem.STARTING_INVENTORY
+    max_count = max(inventory.values())
+    
+    # (heal, reduction %, DEF boost %) of each action, 0 = no item
+    effects = [(0, 0, 0), (0, 0, 0), (0.70, 0, 50), (0.55, 30, 0), (0, 40, 0)]
+    
+    def damage_multiplier(reduction, def_boost):
+        multiplier = 1 - reduction / 100.0
+        return multiplier * (1 - def_boost * 0.5 / 100.0)
+    
+    transitions = {}  # (hp_bin after heal, multiplier) -> [(next bin or -1, probability)]
+    def transition(hp_bin, multiplier):
+        key = (hp_bin, multiplier)
+        if key not in transitions:
+            hp = (hp_bin + 0.5) / hp_bins
+            outcome = {}
+            for fraction, probability in damage_distribution:
+                remaining = hp - fraction * multiplier
+                next_bin = min(int(remaining * hp_bins), hp_bins - 1) if remaining > 0 else -1
+                outcome[next_bin] = outcome.get(next_bin, 0) + probability
+            transitions[key] = list(outcome.items())
+        return transitions[key]
+    
+    rests = list(itertools.product(*[range(max_count + 1)] * len(ITEM_ORDER), (0, 1), (0, 1), (0, 1)))
+    policy = ItemPolicy(bytearray(horizon * hp_bins * len(rests)), hp_bins, horizon, max_count)
+    survived = [1.0] * hp_bins
+    next_values = {rest: survived for rest in rests}  # Values after the last round
+    
+    for round_index in reversed(range(horizon)):
+        expected = {}  # (next rest, hp bin after heal, multiplier) -> survival chance
+        values = {}
+        for rest in rests:
+            counts, (whis_on, android_on, ghost_used) = rest[:len(ITEM_ORDER)], rest[len(ITEM_ORDER):]
+            row = []
+            for hp_bin in range(hp_bins):
+                best_value, best_action = -1.0, 0
+                for action in range(len(ITEM_ORDER) + 1):
+                    if action and counts[action - 1] == 0:
+                        continue
+                    new_counts = list(counts)
+                    if action:
+                        new_counts[action - 1] -= 1
+                    heal, reduction, def_boost = effects[action]
+                    whis_now = whis_on or action == 4
+                    android_now = android_on or action == 2
+                    reduction += 40 if whis_now else 0
+                    def_boost = 50 if android_now else 0
+                    skipped = action == 1 and not ghost_used
+                    multiplier = 0.0 if skipped else damage_multiplier(reduction, def_boost)
+                    healed_bin = min(int(((hp_bin + 0.5) / hp_bins + heal) * hp_bins), hp_bins - 1)
+                    # Whis/Android used now still cover the next round
+                    next_rest = (*new_counts, int(action == 4), int(action == 2), int(ghost_used or action == 1))
+                    key = (next_rest, healed_bin, multiplier)
+                    if key not in expected:
+                        next_row = next_values[next_rest]
+                        expected[key] = sum(probability * next_row[next_bin]
+                                            for next_bin, probability in transition(healed_bin, multiplier)
+                                            if next_bin >= 0)
+                    # Prefer saving items: an item must do strictly better
+                    if expected[key] > best_value + 1e-12:
+                        best_value, best_action = expected[key], action
+                row.append(best_value)
+                policy.table[policy.state_index(round_index, hp_bin, counts, whis_on, android_on, ghost_used)] = best_action
+            values[rest] = row
+        next_values = values
+    return policy
+
+# --- DECISION HINTS ---
+HINT_BUDGET = 0.2  # Seconds per hint
+HINT_ROLLOUTS = 64  # Per action, when the budget allows
+HINT_BATCH = 8
+
+def legal_actions(battle, char_index):
+    """Actions open to a rotation member at the action menu, as (label, action)"""
+    player_char = battle.player_team.rotation[char_index]
+    targets = [(i, enemy) for i, enemy in enumerate(battle.enemy_team.members) if enemy.is_alive()]
+    actions = [(f"Attack {enemy.name} [{i}]", ("attack", i)) for i, enemy in targets]
+    actions += [(f"Use {item.value}", ("item", item)) for item in ITEM_ORDER if battle.inventory.get(item, 0) > 0]
+    if player_char.turn_count >= 4 and player_char.can_use_active_skill(battle):
+        actions += [(f"Active Skill on {enemy.name} [{i}]", ("active", i)) for i, enemy in targets]
+    if battle.dokkan_available and battle.dokkan_character is player_char:
+        actions += [(f"Dokkan Mode on {enemy.name} [{i}]", ("dokkan", i)) for i, enemy in targets]
+    return actions
+
+def rollout_wins(battle, char_index, action, seeds, deadline=None, policy=None):
+    """Play the action, then the rest of the battle headlessly, once per seed.
+    Returns (wins, rollouts finished before the deadline); a rollout still
+    running at the deadline stops between rounds and is not counted."""
+    wins = played = 0
+    for seed in seeds:
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        rollout = HeadlessBattleSystem.from_battle(battle, policy)
+        rollout.metrics = None  # What-ifs, not battles
+        rollout.deadline = deadline
+        random.seed(seed)
+        rollout.play_out(char_index, action)
+        if not rollout.is_finished() and deadline is not None and time.perf_counter() > deadline:
+            break
+        wins += rollout.result()["win"]
+        played += 1
+    return wins, played
+
+_hint_pool = None
+
+def hint_pool(workers):
+    """Process pool kept for the whole session so hints skip worker start-up"""
+    global _hint_pool
+    if _hint_pool is None:
+        _hint_pool = ProcessPoolExecutor(workers)
+        atexit.register(shutdown_hint_pool)
+    return _hint_pool
+
+def shutdown_hint_pool():
+    """Stop the hint workers, dropping queued rollouts (running ones stop at their deadline)"""
+    global _hint_pool
+    if _hint_pool is not None:
+        _hint_pool.shutdown(wait=True, cancel_futures=True)
+        _hint_pool = None
+
+def evaluate_actions(battle, char_index, rollouts=HINT_ROLLOUTS, budget=HINT_BUDGET, workers=None):
+    """Win chance of each legal action within a time budget.
+
+    Every action gets the same rollout seeds, handed out in small batches
+    round-robin so all actions get rollouts before the deadline. Returns
+    (label, action, wins, rollouts, (ci_low, ci_high)) sorted by win rate.
+    """
+    deadline = time.perf_counter() + budget
+    actions = legal_actions(battle, char_index)
+    snapshot = HeadlessBattleSystem.from_battle(battle)
+    batches = [range(start, min(start + HINT_BATCH, rollouts)) for start in range(0, rollouts, HINT_BATCH)]
+    totals = {action: [0, 0] for _, action in actions}
+    workers = workers or os.cpu_count() or 1
+    
+    if workers <= 1:
+        state = random.getstate()  # Rollouts must not disturb the live game's RNG
+        try:
+            for seeds in batches:
+                for _, action in actions:
+                    wins, played = rollout_wins(snapshot, char_index, action, seeds, deadline)
+                    totals[action][0] += wins
+                    totals[action][1] += played
+                if time.perf_counter() > deadline:
+                    break
+        finally:
+            random.setstate(state)
+    else:
+        pool = hint_pool(workers)
+        futures = {pool.submit(rollout_wins, snapshot, char_index, action, seeds, deadline): action
+                   for seeds in batches for _, action in actions}
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.perf_counter()) + 0.05)
+        for future in not_done:
+            future.cancel()  # Running batches stop at the deadline on their own, mid-rollout if need be
+        for future in done:
+            if not future.cancelled():
+                wins, played = future.result()
+                totals[futures[future]][0] += wins
+                totals[futures[future]][1] += played
+    
+    results = [(label, action, *totals[action], wilson_interval(*totals[action])) for label, action in actions]
+    results.sort(key=lambda result: result[2] / result[3] if result[3] else -1, reverse=True)
+    return results
+
+# --- TEAM OPTIMIZER ---
+OPTIMIZER_WEIGHTS = {
+    "atk": 1.0,   # Per point of boosted ATK
+    "def": 0.5,   # Per point of boosted DEF
+    "hp": 0.5,    # Per point of boosted max HP
+    "ki": 1 / 12, # Fraction of boosted ATK each Ki point is worth (12 Ki = Super)
+}
+
+def leader_boost(leader, character):
+    """Combined (hp, atk, def, ki) boost apply_leader_skill gives a character"""
+    hp = atk = defense = 1.0
+    ki = 0
+    for rule in get_leader_skill(leader):
+        if leader_rule_applies(rule, character.categories):
+            hp *= rule["hp"]; atk *= rule["atk"]; defense *= rule["def"]; ki += rule["ki"]
+    return hp, atk, defense, ki
+
+def team_score(team, weights=None):
+    """Score a built team from its boosted stats, leader Ki and get_ki_bonus links"""
+    weights = weights or OPTIMIZER_WEIGHTS
+    score = 0
+    for i, member in enumerate(team.members):
+        ki_value = member.base_attack * weights["ki"]
+        score += (member.base_attack * weights["atk"] + member.base_defense * weights["def"]
+                  + member.max_hp * weights["hp"])
+        score += ki_value * (member.ki + team.get_ki_bonus(i))
+    return score
+
+def build_team(leader, members, enemy_team=None):
+    """Fresh Team with the leader first and its leader skill applied"""
+    enemies = enemy_team.members if enemy_team else []
+    team = Team(is_player=True)
+    for character in [leader, *members]:
+        team.add_member(copy.deepcopy(character), enemies)
+    team.members[0].is_leader = True
+    team.apply_leader_skill(team.members[0])
+    return team
+
+class TeamOptimizer:
+    """Branch-and-bound search for the best team for a leader.
+
+    A team's team_score splits into a per-unit part (leader boosts, links
+    with the leader) and a pair part (+2 Ki each way for units sharing a
+    link, as in Team.update_graph). Both are computed once per candidate, so
+    each search node costs a few lookups. The first pick is split across a
+    process pool; every worker starts from the greedy team's score.
+    """
+    def __init__(self, roster, leader, team_size=6, weights=None):
+        self.leader = leader
+        self.team_size = team_size
+        self.weights = weights or OPTIMIZER_WEIGHTS
+        self.candidates = [c for c in roster if c is not leader]
+        self.timed_out = False  # Set when a search stops at its deadline
+        index = RosterIndex(self.candidates)
+        
+        ki_values = []
+        self.unary = []
+        for character in self.candidates:
+            hp, atk, defense, ki = leader_boost(leader, character)
+            attack = character.base_attack * atk
+            ki_value = attack * self.weights["ki"]
+            linked_to_leader = bool(set(character.links) & set(leader.links))
+            self.unary.append(attack * self.weights["atk"]
+                              + character.base_defense * defense * self.weights["def"]
+                              + character.max_hp * hp * self.weights["hp"]
+                              + ki_value * max(0, min(ki, 24))
+                              + (2 * ki_value if linked_to_leader else 0))
+            ki_values.append(ki_value)
+        
+        # Leader's own terms, and its Ki from each linked candidate
+        hp, atk, defense, ki = leader_boost(leader, leader)
+        self.leader_ki_value = leader.base_attack * atk * self.weights["ki"]
+        self.leader_score = (leader.base_attack * atk * self.weights["atk"]
+                             + leader.base_defense * defense * self.weights["def"]
+                             + leader.max_hp * hp * self.weights["hp"]
+                             + self.leader_ki_value * max(0, min(ki, 24)))
+        for i, character in enumerate(self.candidates):
+            if set(character.links) & set(leader.links):
+                self.unary[i] += 2 * self.leader_ki_value
+        
+        # Linked candidates as bitsets, straight from the roster index
+        self.ki_values = ki_values
+        self.linked = []
+        for i, character in enumerate(self.candidates):
+            bits = 0
+            for link in character.links:
+                bits |= index[link]
+            self.linked.append(bits & ~(1 << i))
+        max_ki_value = max(ki_values, default=0)
+        
+        # Upper bound per candidate: unary + best possible pair with every other pick
+        picks = team_size - 1
+        self.bounds = [self.unary[i] + (picks - 1) * 2 * (ki_values[i] + max_ki_value)
+                       if self.linked[i] else self.unary[i]
+                       for i in range(len(self.candidates))]
+        self.order = sorted(range(len(self.candidates)), key=lambda i: -self.bounds[i])
+        self.prefix = [0]
+        for i in self.order:
+            self.prefix.append(self.prefix[-1] + self.bounds[i])
+        self._pair_cache = {}
+    
+    def pair(self, i, j):
+        """Memoized pair score of two candidates"""
+        key = (i, j) if i < j else (j, i)
+        value = self._pair_cache.get(key)
+        if value is None:
+            value = 2 * (self.ki_values[i] + self.ki_values[j]) if self.linked[i] >> j & 1 else 0
+            self._pair_cache[key] = value
+        return value
+    
+    def score(self, picks):
+        total = self.leader_score
+        for n, i in enumerate(picks):
+            total += self.unary[i]
+            for j in picks[:n]:
+                total += self.pair(i, j)
+        return total
+    
+    def greedy(self):
+        """Pick the best marginal unit until the team is full"""
+        picks = []
+        while len(picks) < self.team_size - 1 and len(picks) < len(self.candidates):
+            best = max((i for i in range(len(self.candidates)) if i not in picks),
+                       key=lambda i: self.unary[i] + sum(self.pair(i, j) for j in picks))
+            picks.append(best)
+        return picks
+    
+    def seed_teams(self, count):
+        """Greedy team plus variants swapping its last pick: a floor for top-k"""
+        greedy = self.greedy()
+        teams = [greedy]
+        if greedy:
+            head = greedy[:-1]
+            rest = sorted((i for i in range(len(self.candidates)) if i not in greedy),
+                          key=lambda i: -(self.unary[i] + sum(self.pair(i, j) for j in head)))
+            teams.extend(head + [i] for i in rest[:count - 1])
+        return teams
+    
+    def search(self, first=None, floor=0.0, top_k=1, deadline=None):
+        """Depth-first branch and bound over self.order.
+
+        first: restrict the first pick to this position in self.order.
+        floor: only keep teams scoring above this.
+        Returns up to top_k (score, picks) pairs, best first. Sets
+        timed_out if the deadline cut the search short.
+        """
+        picks_needed = min(self.team_size - 1, len(self.candidates))
+        best = []  # Min-heap of (score, picks)
+        order, prefix, unary = self.order, self.prefix, self.unary
+        n = len(order)
+        nodes = 0
+        
+        def threshold():
+            return best[0][0] if len(best) >= top_k else floor
+        
+        def extend(start, picks, partial):
+            nonlocal nodes
+            slots = picks_needed - len(picks)
+            if slots == 0:
+                total = self.leader_score + partial
+                if total > threshold():
+                    heapq.heappush(best, (total, list(picks)))
+                    if len(best) > top_k:
+                        heapq.heappop(best)
+                return
+            nodes += 1
+            if deadline is not None and nodes % 1024 == 0 and time.perf_counter() > deadline:
+                self.timed_out = True
+                return
+            for pos in range(start, n - slots + 1):
+                # Best case: the next `slots` units in bound order
+                if self.leader_score + partial + prefix[pos + slots] - prefix[pos] <= threshold():
+                    return
+                i = order[pos]
+                gain = unary[i]
+                for j in picks:
+                    gain += self.pair(i, j)
+                picks.append(i)
+                extend(pos + 1, picks, partial + gain)
+                picks.pop()
+        
+        if first is None:
+            extend(0, [], 0.0)
+        elif first <= n - picks_needed:
+            i = order[first]
+            extend(first + 1, [i], unary[i])
+        return sorted(best, reverse=True)
+    
+    def optimize(self, top_k=1, workers=None, time_limit=60.0):
+        """Best top_k teams as (score, [leader, *members]) pairs. If time_limit
+        runs out first, timed_out is set and the teams are the best found."""
+        deadline = time.perf_counter() + time_limit
+        self.timed_out = False
+        seeds = self.seed_teams(top_k)
+        scores = sorted((self.score(picks) for picks in seeds), reverse=True)
+        floor = scores[top_k - 1] * (1 - 1e-9) if len(scores) >= top_k else 0.0
+        workers = workers or os.cpu_count() or 1
+        picks = min(self.team_size - 1, len(self.candidates))
+        
+        if workers <= 1 or picks == 0:  # No candidates: nothing to split over workers
+            results = self.search(floor=floor, top_k=top_k, deadline=deadline)
+        else:
+            results = []
+            # First picks whose best case cannot beat the floor are never sent
+            firsts = [first for first in range(len(self.order) - picks + 1)
+                      if self.leader_score + self.prefix[first + picks] - self.prefix[first] > floor]
+            with ProcessPoolExecutor(workers, initializer=_init_optimizer_worker, initargs=(self,)) as pool:
+                for found, timed_out in pool.map(_optimizer_subtree, firsts, [floor] * len(firsts),
+                                                 [top_k] * len(firsts), [deadline] * len(firsts), chunksize=8):
+                    results.extend(found)
+                    self.timed_out |= timed_out
+            results = sorted(results, reverse=True)[:top_k]
+        
+        if len(results) < top_k:
+            # The floor came from the seed teams: fill in from them
+            known = {tuple(sorted(picks)) for _, picks in results}
+            for team in seeds:
+                if tuple(sorted(team)) not in known:
+                    results.append((self.score(team), team))
+            results = sorted(results, reverse=True)[:top_k]
+        return [(score, [self.leader] + [self.candidates[i] for i in picks]) for score, picks in results]
+
+_optimizer = None
+
+def _init_optimizer_worker(optimizer):
+    global _optimizer
+    _optimizer = optimizer
+
+def _optimizer_subtree(first, floor, top_k, deadline):
+    _optimizer.timed_out = False
+    return _optimizer.search(first=first, floor=floor, top_k=top_k, deadline=deadline), _optimizer.timed_out
+
+def optimize_team(roster, leader, top_k=5, enemy_team=None, battles=0, workers=None, time_limit=60.0):
+    """Best teams for a leader from a roster.
+
+    Teams are ranked by team_score; with enemy_team and battles > 0 the top_k
+    are re-ranked by simulated win rate. Returns a list of dicts with the
+    built team, its score, win_rate (None when not simulated) and
+    exhaustive (False when time_limit stopped the search before it proved
+    these are the best teams).
+    """
+    optimizer = TeamOptimizer(roster, leader)
+    ranked = []
+    for score, members in optimizer.optimize(top_k, workers, time_limit):
+        team = build_team(members[0], members[1:], enemy_team)
+        win_rate = None
+        if enemy_team is not None and battles > 0:
+            win_rate = run_simulations(team, enemy_team, battles)["win_rate"]
+        ranked.append({"team": team, "score": score, "win_rate": win_rate, "exhaustive": not optimizer.timed_out})
+    if enemy_team is not None and battles > 0:
+        ranked.sort(key=lambda entry: (entry["win_rate"], entry["score"]), reverse=True)
+    return ranked
+
+# --- ROTATION PLANNER ---
+def rotation_schedule(order, rounds):
+    """Positions fighting in each round for a team order, following
+    Team.setup_rotation and Team.rotate_team"""
+    rotation = deque(order[:3])
+    reserve = deque(order[3:])
+    schedule = []
+    for _ in range(rounds):
+        schedule.append(tuple(rotation))
+        if reserve:
+            reserve.append(rotation.popleft())
+            rotation.append(reserve.popleft())
+    return schedule
+
+class RotationPlanner:
+    """Finds the team order (who fights when) with the best outcome.
+
+    Orderings are first ranked analytically: ATK of the units fighting each
+    round, discounted so early rounds count more. The best `candidates` are
+    then simulated on a worker pool. Results are cached by ordering
+    signature (the unit names in order), so duplicate units and repeated
+    plans are never simulated twice.
+    """
+    ROUND_DISCOUNT = 0.8
+    
+    def __init__(self, team, enemy_team, battles=200, seed=0, policy=None):
+        self.team = team
+        self.enemy_team = enemy_team
+        self.battles = battles
+        self.seed = seed
+        self.policy = policy
+        self.cache = {}  # Ordering signature -> run_simulations summary
+    
+    def signature(self, order):
+        return tuple(self.team.members[i].name for i in order)
+    
+    def analytic_score(self, order, rounds=10):
+        score = 0
+        weight = 1.0
+        for rotation in rotation_schedule(order, rounds):
+            score += weight * sum(self.team.members[i].get_final_attack() for i in rotation)
+            weight *= self.ROUND_DISCOUNT
+        return score
+    
+    def ordered_team(self, order):
+        team = copy.deepcopy(self.team)
+        team.members = [team.members[i] for i in order]
+        team.update_graph()
+        return team
+    
+    def evaluate(self, orders, workers=None):
+        """Simulate the orderings not in the cache; returns {signature: summary}"""
+        pending = {}
+        for order in orders:
+            key = self.signature(order)
+            if key not in self.cache and key not in pending:
+                pending[key] = order
+        workers = workers or os.cpu_count() or 1
+        
+        if workers <= 1 or len(pending) <= 1:
+            for key, order in pending.items():
+                self.cache[key] = run_simulations(self.ordered_team(order), self.enemy_team,
+                                                  self.battles, self.seed, self.policy)
+        else:
+            teams = [self.ordered_team(order) for order in pending.values()]
+            with ProcessPoolExecutor(workers) as pool:
+                summaries = pool.map(_simulate_ordering, teams, [self.enemy_team] * len(teams),
+                                     [self.battles] * len(teams), [self.seed] * len(teams),
+                                     [self.policy] * len(teams))
+                for key, summary in zip(pending, summaries):
+                    self.cache[key] = summary
+        return {self.signature(order): self.cache[self.signature(order)] for order in orders}
+    
+    def plan(self, objective="win_rate", candidates=None, workers=None):
+        """Best ordering as (member indices, summary).
+
+        objective: "win_rate" (ties broken by fewer turns) or "turns"
+        (fewest turns to win, ties broken by win rate).
+        candidates: how many analytically ranked orderings to simulate
+        (None simulates every ordering).
+        """
+        orders = sorted(itertools.permutations(range(len(self.team.members))),
+                        key=self.analytic_score, reverse=True)
+        if candidates is not None:
+            orders = orders[:candidates]
+        results = self.evaluate(orders, workers)
+        
+        def key(order):
+            summary = results[self.signature(order)]
+            win_turns = summary["avg_win_turns"]
+            if win_turns is None:
+                win_turns = float("inf")
+            if objective == "turns":
+                return (win_turns, -summary["win_rate"])
+            return (-summary["win_rate"], win_turns)
+        
+        best = min(orders, key=key)
+        return list(best), results[self.signature(best)]
+
+def _simulate_ordering(team, enemy_team, battles, seed, policy):
+    return run_simulations(team, enemy_team, battles, seed, policy)
+
+# --- PARAMETER SWEEP ---
+BOSS_STAT_FIELDS = {
+    "hp": ("hp", "max_hp"),
+    "attack": ("base_attack", "attack"),
+    "defense": ("base_defense", "defense"),
+    "damage_reduction": ("damage_reduction",),
+    "max_attacks_per_turn": ("max_attacks_per_turn",),
+}
+
+def build_sweep_scenario(config):
+    """Vegeta battle with tuned parameters. Returns (player_team, enemy_team).
+
+    Parameter names:
+      leader:<leader name>:<rule index>:<hp|atk|def|ki>  LEADER_SKILL_DATABASE entry
+      passive:<name fragment or *>:<key>                 passive_skills entry
+      super:<name fragment or *>:<key>                   super_attack_effects entry
+      boss:<hp|attack|defense|damage_reduction|max_attacks_per_turn>
+    """
+    leader_skills = copy.deepcopy(LEADER_SKILL_DATABASE)
+    for name, value in config.items():
+        kind, *path = name.split(":")
+        if kind == "leader":
+            leader, rule, field = path
+            leader_skills[leader][int(rule)][field] = value
+    
+    enemy_team = create_vegeta_team()
+    player_team = create_player_team(enemy_team, leader_skills)
+    
+    for name, value in config.items():
+        kind, *path = name.split(":")
+        if kind == "leader":
+            continue
+        if kind == "boss":
+            if path[0] not in BOSS_STAT_FIELDS:
+                raise ValueError(f"Unknown boss stat: {path[0]}")
+            for enemy in enemy_team.members:
+                for field in BOSS_STAT_FIELDS[path[0]]:
+                    setattr(enemy, field, value)
+        elif kind in ("passive", "super"):
+            fragment, key = path
+            for member in player_team.members:
+                if fragment == "*" or fragment in member.name:
+                    effects = member.passive_skills if kind == "passive" else member.super_attack_effects
+                    effects[key] = value
+        else:
+            raise ValueError(f"Unknown parameter: {name}")
+    return player_team, enemy_team
+
+def sweep_range(start, stop, steps):
+    """steps evenly spaced values from start to stop (inclusive)"""
+    if steps <= 1:
+        return [start]
+    return [start + (stop - start) * i / (steps - 1) for i in range(steps)]
+
+class ParameterSweep:
+    """Win rate over the Cartesian product of parameter values.
+
+    Each configuration plays batches of `batch` battles. Every configuration
+    uses the same seeds, so they are directly comparable. A configuration
+    stops once its Wilson interval is narrower than 2 * precision, or
+    excludes `target` when one is given, or reaches max_battles. Batches
+    from all unsettled configurations share one process pool.
+    """
+    def __init__(self, grid, scenario=build_sweep_scenario, batch=200, max_battles=5000,
+                 precision=0.02, target=None, seed=0, policy=None):
+        self.names = list(grid)
+        self.configs = [dict(zip(self.names, values)) for values in itertools.product(*grid.values())]
+        self.scenario = scenario
+        self.batch = batch
+        self.max_battles = max_battles
+        self.precision = precision
+        self.target = target
+        self.seed = seed
+        self.policy = policy
+        self.stats = [SimulationStats() for _ in self.configs]
+    
+    def settled(self, index):
+        stats = self.stats[index]
+        if stats.battles >= self.max_battles:
+            return True
+        if stats.battles == 0:
+            return False
+        low, high = wilson_interval(stats.wins, stats.battles)
+        if self.target is not None and (high < self.target or low > self.target):
+            return True
+        return (high - low) / 2 <= self.precision
+    
+    def run(self, workers=None):
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1:
+            pending = list(range(len(self.configs)))
+            while pending:
+                for index in pending:
+                    self.stats[index].merge(_sweep_batch(self.scenario, self.configs[index],
+                                                         self.seed + self.stats[index].battles,
+                                                         self.batch_size(index), self.policy))
+                pending = [index for index in pending if not self.settled(index)]
+            return self.rows()
+        
+        with ProcessPoolExecutor(workers) as pool:
+            running = {}
+            def submit(index):
+                future = pool.submit(_sweep_batch, self.scenario, self.configs[index],
+                                     self.seed + self.stats[index].battles, self.batch_size(index), self.policy)
+                running[future] = index
+            # Batches of one configuration run one after another so seeds stay contiguous
+            for index in range(len(self.configs)):
+                submit(index)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    self.stats[index].merge(future.result())
+                    if not self.settled(index):
+                        submit(index)
+        return self.rows()
+    
+    def batch_size(self, index):
+        return min(self.batch, self.max_battles - self.stats[index].battles)
+    
+    def rows(self):
+        rows = []
+        for config, stats in zip(self.configs, self.stats):
+            summary = stats.summary()
+            low, high = wilson_interval(stats.wins, stats.battles)
+            rows.append({**config, "battles": stats.battles, "win_rate": summary["win_rate"],
+                         "ci_low": low, "ci_high": high, "avg_turns": summary["avg_turns"]})
+        return rows
+    
+    def write_csv(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=self.names + ["battles", "win_rate", "ci_low", "ci_high", "avg_turns"])
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+_sweep_scenarios = {}  # Per process: config -> built teams
+
+def _sweep_batch(scenario, config, start, count, policy):
+    key = (scenario, tuple(sorted(config.items())))
+    if key not in _sweep_scenarios:
+        _sweep_scenarios[key] = scenario(config)
+    player_team, enemy_team = _sweep_scenarios[key]
+    return simulate_stats(player_team, enemy_team, count, start, policy)
+
+# --- TOURNAMENT ---
+class Tournament:
+    """Every player team against every enemy team, `battles` times each.
+
+    Matchups are cut into seed chunks that all go through one pool queue, so
+    idle workers take the next chunk of whatever cell still has work. Every
+    matchup uses seeds seed..seed+battles-1. Each finished cell is appended
+    to the results CSV right away. Running again with the same file skips
+    the cells already in it, so a killed tournament resumes where it stopped.
+    """
+    FIELDS = ["team", "enemy", "battles", "wins", "win_rate", "avg_turns"]
+    FIELD_TYPES = {"battles": int, "wins": int, "win_rate": float, "avg_turns": float}
+    
+    def __init__(self, teams, enemies, battles=1000, seed=0, policy=None, chunk_size=250):
+        self.teams = teams        # name -> player Team
+        self.enemies = enemies    # name -> enemy Team
+        self.battles = battles
+        self.seed = seed
+        self.policy = policy
+        self.chunk_size = chunk_size
+    
+    def read_results(self, path):
+        """Finished cells in a results CSV: (team, enemy) -> row"""
+        if not os.path.exists(path):
+            return {}
+        with open(path, newline="") as file:
+            text = file.read()
+        # A kill can cut the last row anywhere, even inside a number that
+        # still parses, so only rows ended by a line break are trusted
+        lines = text.splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            lines.pop()
+        finished = {}
+        for row in csv.DictReader(lines):
+            row = self.parse_row(row)
+            if row and row["battles"] == self.battles:
+                finished[row["team"], row["enemy"]] = row
+        return finished
+    
+    def parse_row(self, row):
+        """A results row with its numbers parsed, or None if it is malformed"""
+        if None in row or None in row.values():  # Too many or too few fields
+            return None
+        try:
+            return {name: self.FIELD_TYPES.get(name, str)(row[name]) for name in self.FIELDS}
+        except (KeyError, ValueError):
+            return None
+    
+    def run(self, path, workers=None):
+        """Play all unfinished cells, appending them to path. Returns all rows."""
+        finished = self.read_results(path)
+        cells = [(team, enemy) for team in self.teams for enemy in self.enemies
+                 if (team, enemy) not in finished]
+        tasks = [(team, enemy, start, min(self.chunk_size, self.seed + self.battles - start))
+                 for team, enemy in cells
+                 for start in range(self.seed, self.seed + self.battles, self.chunk_size)]
+        remaining = {cell: -(-self.battles // self.chunk_size) for cell in cells}
+        stats = {cell: SimulationStats() for cell in cells}
+        
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                partial_line = file.read(1) != b"\n"
+        with open(path, "a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=self.FIELDS)
+            if new_file:
+                writer.writeheader()
+                file.flush()
+            elif partial_line:
+                file.write("\r\n")
+            
+            def record(cell):
+                summary = stats.pop(cell).summary()
+                row = {"team": cell[0], "enemy": cell[1], "battles": summary["battles"],
+                       "wins": summary["wins"], "win_rate": summary["win_rate"],
+                       "avg_turns": summary["avg_turns"]}
+                writer.writerow(row)
+                file.flush()
+                finished[cell] = row
+            
+            def finish(cell, chunk):
+                stats[cell].merge(chunk)
+                remaining[cell] -= 1
+                if remaining[cell] == 0:
+                    record(cell)
+            
+            for cell in cells:
+                if remaining[cell] == 0:  # battles=0: nothing to play, but the cell is done
+                    record(cell)
+            workers = workers or os.cpu_count() or 1
+            if workers <= 1:
+                _init_tournament_worker(self.teams, self.enemies, self.policy)
+                for task in tasks:
+                    finish(task[:2], _tournament_chunk(*task))
+            else:
+                with ProcessPoolExecutor(workers, initializer=_init_tournament_worker,
+                                         initargs=(self.teams, self.enemies, self.policy)) as pool:
+                    futures = {pool.submit(_tournament_chunk, *task): task[:2] for task in tasks}
+                    for future in as_completed(futures):
+                        finish(futures[future], future.result())
+        return list(finished.values())
+    
+    def write_matrix(self, path, rows):
+        """Win-rate matrix CSV: one row per team, one column per enemy"""
+        rates = {(row["team"], row["enemy"]): row["win_rate"] for row in rows}
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["team"] + list(self.enemies))
+            for team in self.teams:
+                writer.writerow([team] + [rates.get((team, enemy), "") for enemy in self.enemies])
+
+_tournament_setup = None
+
+def _init_tournament_worker(teams, enemies, policy):
+    global _tournament_setup
+    _tournament_setup = (teams, enemies, policy)
+
+def _tournament_chunk(team, enemy, start, count):
+    teams, enemies, policy = _tournament_setup
+    return simulate_stats(teams[team], enemies[enemy], count, start, policy)
+
+# --- SAVE FILES ---
+SAVE_MAGIC = b"DKSV"
+SAVE_VERSION = 2
+SAVE_HEADER = struct.Struct("<4sHII")  # Magic, format version, payload length, CRC-32 of payload
+SAVE_EXCLUDED = {"policy", "fast_forward_policy", "checkpoint", "console"}  # Code and I/O, not state
+SAVE_ENUMS = {cls.__name__: cls for cls in (Attribute, EvasionLevel, StatusEffect, Category, SupportItem, LinkSkillEffect)}
+SAVE_MIGRATIONS = {}  # Format version -> function upgrading a decoded state to the next version
+
+# Value tags. Objects are written once with their attribute shape, then referenced by index
+(TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_BYTE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_LIST, TAG_TUPLE,
+ TAG_DEQUE, TAG_DICT, TAG_ENUM, TAG_OBJECT, TAG_REF, TAG_BYTES, TAG_BEHAVIOR, TAG_BIGINT) = range(17)
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+def save_classes():
+    return {"Character": Character, "Team": Team, "KiSphere": KiSphere, "KiBoard": KiBoard}
+
+def encode_state(state):
+    """Payload for a state tree: string table, object shapes, then the tagged values.
+
+    Strings (names, dict keys, enum members) are stored once and referenced
+    by index. Each object class/attribute-name combination is a shape
+    stored once, so objects are a shape index followed by bare values.
+    """
+    strings, string_index = [], {}
+    shapes, shape_index = [], {}
+    objects = {}
+    classes = tuple(save_classes().values())
+    body = bytearray()
+    
+    def string(text):
+        index = string_index.get(text)
+        if index is None:
+            index = string_index[text] = len(strings)
+            strings.append(text)
+        return index
+    
+    def write(value):
+        if value is None:
+            body.append(TAG_NONE)
+        elif value is True or value is False:
+            body.append(TAG_TRUE if value else TAG_FALSE)
+        elif isinstance(value, Enum):
+            if SAVE_ENUMS.get(type(value).__name__) is not type(value):
+                raise ValueError(f"Cannot save {type(value).__name__} values: not in SAVE_ENUMS")
+            body.append(TAG_ENUM)
+            body.extend(_U16.pack(string(type(value).__name__)))
+            body.extend(_U16.pack(string(value.name)))
+        elif isinstance(value, int):
+            if 0 <= value < 256:
+                body.append(TAG_BYTE)
+                body.append(value)
+            elif -2 ** 63 <= value < 2 ** 63:
+                body.append(TAG_INT)
+                body.extend(_I64.pack(value))
+            else:
+                body.append(TAG_BIGINT)
+                write(str(value))
+        elif isinstance(value, float):
+            body.append(TAG_FLOAT)
+            body.extend(_F64.pack(value))
+        elif isinstance(value, str):
+            body.append(TAG_STR)
+            body.extend(_U16.pack(string(value)))
+        elif isinstance(value, (list, tuple, deque)):
+            body.append(TAG_LIST if isinstance(value, list) else TAG_TUPLE if isinstance(value, tuple) else TAG_DEQUE)
+            body.extend(_U16.pack(len(value)))
+            for item in value:
+                write(item)
+        elif isinstance(value, dict):
+            body.append(TAG_DICT)
+            body.extend(_U16.pack(len(value)))
+            for key, item in value.items():
+                write(key)
+                write(item)
+        elif isinstance(value, (bytes, bytearray)):
+            body.append(TAG_BYTES)
+            body.extend(_U32.pack(len(value)))
+            body.extend(value)
+        elif isinstance(value, EnemyBehavior):
+            body.append(TAG_BEHAVIOR)  # Recompiled from its script on load
+            write(value.script)
+        elif isinstance(value, classes):
+            if id(value) in objects:
+                body.append(TAG_REF)
+                body.extend(_U16.pack(objects[id(value)]))
+                return
+            objects[id(value)] = len(objects)
+            attributes = vars(value)
+            shape = (type(value).__name__, tuple(attributes))
+            index = shape_index.get(shape)
+            if index is None:
+                index = shape_index[shape] = len(shapes)
+                shapes.append([string(name) for name in (shape[0],) + shape[1]])
+            body.append(TAG_OBJECT)
+            body.extend(_U16.pack(index))
+            for item in attributes.values():
+                write(item)
+        else:
+            raise TypeError(f"Cannot save {type(value).__name__}")
+    
+    write(state)
+    head = bytearray(_U16.pack(len(strings)))
+    for text in strings:
+        encoded = text.encode()
+        head.extend(_U16.pack(len(encoded)))
+        head.extend(encoded)
+    head.extend(_U16.pack(len(shapes)))
+    for shape in shapes:
+        head.extend(_U16.pack(len(shape)))
+        for index in shape:
+            head.extend(_U16.pack(index))
+    return bytes(head + body)
+
+def decode_state(payload):
+    """Inverse of encode_state"""
+    data = memoryview(payload)
+    u16 = _U16.unpack_from
+    position = 0
+    
+    count, = u16(data, position)
+    position += 2
+    strings = []
+    for _ in range(count):
+        length, = u16(data, position)
+        strings.append(str(data[position + 2:position + 2 + length], "utf-8"))
+        position += 2 + length
+    
+    classes = save_classes()
+    shapes = []
+    count, = u16(data, position)
+    position += 2
+    for _ in range(count):
+        length, = u16(data, position)
+        names = [strings[index] for index in struct.unpack_from(f"<{length}H", data, position + 2)]
+        position += 2 + 2 * length
+        shapes.append((classes[names[0]], names[1:], shape_defaults(classes[names[0]], names[1:])))
+    
+    objects = []
+    
+    def read():
+        nonlocal position
+        tag = data[position]
+        position += 1
+        if tag == TAG_BYTE:
+            position += 1
+            return data[position - 1]
+        if tag == TAG_STR:
+            position += 2
+            return strings[u16(data, position - 2)[0]]
+        if tag == TAG_FLOAT:
+            position += 8
+            return _F64.unpack_from(data, position - 8)[0]
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_DICT:
+            count, = u16(data, position)
+            position += 2
+            result = {}
+            for _ in range(count):
+                key = read()
+                result[key] = read()
+            return result
+        if tag == TAG_LIST or tag == TAG_TUPLE or tag == TAG_DEQUE:
+            count, = u16(data, position)
+            position += 2
+            items = [read() for _ in range(count)]
+            return items if tag == TAG_LIST else tuple(items) if tag == TAG_TUPLE else deque(items)
+        if tag == TAG_ENUM:
+            enum_name, member = struct.unpack_from("<HH", data, position)
+            position += 4
+            return SAVE_ENUMS[strings[enum_name]][strings[member]]
+        if tag == TAG_OBJECT:
+            cls, names, defaults = shapes[u16(data, position)[0]]
+            position += 2
+            obj = cls.__new__(cls)
+            objects.append(obj)
+            attributes = obj.__dict__
+            for name in names:
+                attributes[name] = read()
+            if defaults:
+                for name, default in defaults.items():
+                    attributes[name] = copy.deepcopy(default)
+            return obj
+        if tag == TAG_REF:
+            position += 2
+            return objects[u16(data, position - 2)[0]]
+        if tag == TAG_INT:
+            position += 8
+            return _I64.unpack_from(data, position - 8)[0]
+        if tag == TAG_BYTES:
+            length, = _U32.unpack_from(data, position)
+            position += 4 + length
+            return bytes(data[position - length:position])
+        if tag == TAG_BEHAVIOR:
+            return EnemyBehavior(read())
+        if tag == TAG_BIGINT:
+            return int(read())
+        raise ValueError(f"Corrupt save data: unknown tag {tag}")
+    
+    return read()
+
+_shape_defaults = {}
+
+def shape_defaults(cls, names):
+    """Attributes a fresh instance has that an older save lacks, with their
+    constructor defaults, so saves stay loadable as classes grow"""
+    key = (cls, tuple(names))
+    if key not in _shape_defaults:
+        prototype = {
+            Character: lambda: Character("", Attribute.STR, 1, 1, 1),
+            Team: Team,
+            KiSphere: lambda: KiSphere(Attribute.STR),
+            KiBoard: KiBoard,
+        }[cls]()
+        _shape_defaults[key] = {name: value for name, value in vars(prototype).items() if name not in names}
+    return _shape_defaults[key]
+
+def pack_save(state):
+    try:
+        payload = encode_state(state)
+    except struct.error as error:  # A count, index or string past the 16-bit fields
+        raise ValueError(f"Battle state too large to save: {error}") from None
+    return SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, len(payload), zlib.crc32(payload)) + payload
+
+def unpack_save(data):
+    """Checked, migrated state from pack_save bytes"""
+    if len(data) < SAVE_HEADER.size:
+        raise ValueError("Save data is truncated")
+    magic, version, length, checksum = SAVE_HEADER.unpack_from(data)
+    if magic != SAVE_MAGIC:
+        raise ValueError("Not a battle save")
+    if version > SAVE_VERSION:
+        raise ValueError(f"Save format {version} is newer than this game supports ({SAVE_VERSION})")
+    payload = memoryview(data)[SAVE_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise ValueError("Save data is corrupt (checksum mismatch)")
+    try:
+        state = decode_state(payload)
+    except (struct.error, IndexError, KeyError) as error:  # Unknown enum member, bad index, short payload
+        raise ValueError(f"Save data is corrupt ({error!r})") from None
+    while version < SAVE_VERSION:
+        state = SAVE_MIGRATIONS[version](state)
+        version += 1
+    return state
+
+def _migrate_attribute_codes(state):
+    """Version 1 saves predate Character.attribute_code"""
+    neutral = ATTRIBUTE_CODES[Attribute.RAINBOW]
+    for team in (state["battle"]["player_team"], state["battle"]["enemy_team"]):
+        for member in team.members:
+            member.attribute_code = ATTRIBUTE_CODES.get(member.attribute, neutral)
+    return state
+
+SAVE_MIGRATIONS[1] = _migrate_attribute_codes
+
+# --- SCRIPTED REPLAY ---
+def read_script(stream):
+    """Recorded answers, one per line; lines starting with # are comments.
+    Returns (answers, seed) where seed comes from a "# seed N" header."""
+    answers, seed = [], None
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if line.startswith("# seed "):
+            seed = int(line[len("# seed "):])
+        elif not line.startswith("#"):
+            answers.append(line)
+    return answers, seed
+
+class ScriptedConsole(Console):
+    """Answers from a recorded script; pauses and screen clearing are no-ops"""
+    def __init__(self, answers):
+        self.answers = iter(answers)
+        self.used = 0
+    
+    def input(self, prompt="", timeout=None):
+        try:
+            answer = next(self.answers)
+        except StopIteration:
+            raise EOFError("replay script exhausted") from None
+        self.used += 1
+        print(f"{prompt}{answer}")  # Echo so the transcript reads like a terminal
+        return None if timeout is not None and answer == TIMEOUT_ANSWER else answer
+    
+    def press_any_key(self):
+        pass
+    
+    def clear_screen(self):
+        pass
+
+class RecordingConsole(Console):
+    """The keyboard, writing each answer to a script"""
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def input(self, prompt="", timeout=None):
+        answer = console_input(prompt, timeout)
+        self.stream.write((TIMEOUT_ANSWER if answer is None else answer) + "\n")
+        self.stream.flush()
+        return answer
+
+class ReplaySession:
+    """Drive the interactive game from a script without a TTY.
+
+    Answers come from a ScriptedConsole installed for this thread only,
+    press_any_key and clear_screen are no-ops and everything printed is
+    captured in `output`.
+    """
+    def __init__(self, answers, seed=None):
+        self.answers = list(answers)
+        self.seed = seed
+        self.output = ""
+        self.used = 0
+        self.finished = False
+    
+    def run(self, entry=None):
+        """Play entry (main_menu by default); True if it returned before the script ran out"""
+        scripted = ScriptedConsole(self.answers)
+        buffer = io.StringIO()
+        state = random.getstate()
+        try:
+            random.seed(self.seed)
+            with use_console(scripted), redirect_stdout(buffer), private_saves():
+                (entry or main_menu)()
+            self.finished = True
+        except EOFError:
+            self.finished = False
+        finally:
+            random.setstate(state)
+        self.output = buffer.getvalue()
+        self.used = scripted.used
+        return self.finished
+
+def replay_scripts(paths, seed=None, entry=None):
+    """Replay recorded sessions in turn, yielding (path, session).
+    A seed given here overrides the one recorded in each script."""
+    for path in paths:
+        if path == "-":
+            answers, recorded_seed = read_script(sys.stdin)
+        else:
+            with open(path) as f:
+                answers, recorded_seed = read_script(f)
+        session = ReplaySession(answers, recorded_seed if seed is None else seed)
+        session.run(entry)
+        yield path, session
+
+# --- SESSION SERVER ---
+SESSION_STACK_SIZE = 512 * 1024  # Game threads are shallow; keeps thousands of sessions cheap
+SESSION_READ_LIMIT = 1 << 20
+PROMPT_MARK = "\x00"  # Sent after each prompt with --mark-prompts, for scripted clients
+
+_session_local = threading.local()
+
+class GameSession(Console):
+    """One client's game. The synchronous game runs on its own thread and
+    parks on a queue whenever it waits for an answer; the event loop owns
+    the socket, feeding answers in and writing output back."""
+    def __init__(self, loop, writer, prompt_mark=""):
+        self.loop = loop
+        self.writer = writer
+        self.prompt_mark = prompt_mark
+        self.answers = queue.SimpleQueue()  # (prompt number when it arrived, line); line None at disconnect
+        self.pending = []
+        self.prompt_number = 0
+        self.expired = set()  # Prompts that timed out; late answers to them are dropped
+    
+    def write(self, text):
+        self.pending.append(text)
+        return len(text)
+    
+    def flush(self):
+        """Send buffered output to the client in one write"""
+        if self.pending:
+            data = "".join(self.pending).encode()
+            self.pending.clear()
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+    
+    def input(self, prompt="", timeout=None):
+        self.prompt_number += 1
+        number = self.prompt_number
+        self.write(prompt + self.prompt_mark)
+        self.flush()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                answered, answer = self.answers.get(timeout=remaining)
+            except queue.Empty:
+                self.expired.add(number)
+                return None
+            if answer is None:
+                raise EOFError("client disconnected")
+            if answered not in self.expired:
+                return answer
+    
+    def press_any_key(self):
+        pass
+    
+    def clear_screen(self):
+        pass
+    
+    def play(self, entry):
+        _session_local.session = self
+        try:
+            with use_console(self), private_saves():
+                entry()
+        except EOFError:
+            pass
+        except Exception as exc:
+            self.write(f"\nSession error: {exc!r}\n")
+        finally:
+            _session_local.session = None
+            self.flush()
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+class SessionOutput:
+    """sys.stdout while serving: session threads print to their own client"""
+    def __init__(self, fallback):
+        self.fallback = fallback
+    
+    def write(self, text):
+        return (getattr(_session_local, "session", None) or self.fallback).write(text)
+    
+    def flush(self):
+        (getattr(_session_local, "session", None) or self.fallback).flush()
+
+@contextmanager
+def session_console():
+    """Install the per-session output routing for the server's lifetime
+    (each session thread reads its own answers, see GameSession.play)"""
+    saved_stdout = sys.stdout
+    saved_stack = threading.stack_size(SESSION_STACK_SIZE)
+    sys.stdout = SessionOutput(saved_stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = saved_stdout
+        threading.stack_size(saved_stack)
+
+async def serve_sessions(host="127.0.0.1", port=8765, path=None, entry=None, prompt_mark="", ready=None):
+    """Serve a game per connection over TCP, or a Unix socket when path is given.
+    ready, if given, is an asyncio.Future resolved with the server once listening."""
+    entry = entry or main_menu
+    
+    async def handle(reader, writer):
+        session = GameSession(asyncio.get_running_loop(), writer, prompt_mark)
+        threading.Thread(target=session.play, args=(entry,), daemon=True).start()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                session.answers.put((session.prompt_number, line.decode(errors="replace").rstrip("\r\n")))
+        except ConnectionError:
+            pass
+        finally:
+            session.answers.put((session.prompt_number, None))
+    
+    with session_console():
+        if path:
+            server = await asyncio.start_unix_server(handle, path)
+        else:
+            server = await asyncio.start_server(handle, host, port, backlog=1024)
+        async with server:
+            if ready is not None:
+                ready.set_result(server)
+            await server.serve_forever()
+
+async def play_remote_session(answers, latency, host="127.0.0.1", port=8765, path=None):
+    """Play scripted answers against a server started with prompt marks.
+    Adds answer-to-next-prompt times to latency; True if the game ended
+    before the script ran out."""
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path, limit=SESSION_READ_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=SESSION_READ_LIMIT)
+    mark = PROMPT_MARK.encode()
+    try:
+        await reader.readuntil(mark)
+        for answer in answers:
+            start = time.perf_counter()
+            writer.write((answer + "\n").encode())
+            try:
+                await reader.readuntil(mark)
+            except asyncio.IncompleteReadError:
+                return True
+            latency.add(time.perf_counter() - start)
+        return False
+    except asyncio.IncompleteReadError:
+        return True
+    finally:
+        writer.close()
+
+async def load_test(sessions, answers, host="127.0.0.1", port=8765, path=None, concurrency=256):
+    """Open sessions scripted games, at most concurrency at once"""
+    latency = RunningStat(low=1e-5, high=10.0, buckets=100, log=True)
+    limit = asyncio.Semaphore(concurrency)
+    
+    async def one():
+        async with limit:
+            return await play_remote_session(answers, latency, host, port, path)
+    
+    start = time.perf_counter()
+    finished = await asyncio.gather(*(one() for _ in range(sessions)))
+    seconds = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "finished": sum(finished),
+        "seconds": seconds,
+        "sessions_per_sec": sessions / seconds,
+        "latency": latency.summary(),
+    }
+
+# --- MAIN SECTION ---
+SAVE_PATH = "dokkan_save.bin"  # The keyboard player's save
+_save_local = threading.local()
+
+def save_path():
+    """This thread's save file: SAVE_PATH, or the private one of a server
+    session or scripted run (see private_saves)"""
+    return getattr(_save_local, "path", None) or SAVE_PATH
+
+@contextmanager
+def private_saves():
+    """Give this thread's game an empty save slot of its own until exit, so
+    concurrent sessions and replays never share, see or clobber a save"""
+    directory = tempfile.mkdtemp(prefix="dokkan_saves_")
+    _save_local.path = os.path.join(directory, os.path.basename(SAVE_PATH))
+    try:
+        yield _save_local.path
+    finally:
+        _save_local.path = None
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main_menu():
+    while True:
+        current_console().clear_screen()
+        print("Dokkan-Python v1.3")
         print("===== DOKKAN-LIKE BATTLE =====")
         print("1. Start New Battle")
-        print("2. View Game Info")
-        print("3. Exit")
+        print("2. Start Boss Rush")
+        print("3. View Game Info")
+        print("4. Exit")
+        if os.path.exists(save_path()):
+            print("R. Resume Saved Battle")
+        answer = ask("\nYour choice: ").strip().lower()
+        if answer == "r" and os.path.exists(save_path()):
+            resume_saved_battle()
+            continue
         try: 
-            choice = int(input("\nYour choice: "))
+            choice = int(answer)
         except ValueError: 
             continue
         if choice == 1: 
             start_new_battle()
         elif choice == 2: 
-            show_game_info()
+            start_boss_rush()
         elif choice == 3: 
+            show_game_info()
+        elif choice == 4: 
             print("\nThanks for playing!")
             break
 
 def show_game_info():
-    BattleSystem.clear_screen()
+    current_console().clear_screen()
     print("===== GAME INFORMATION =====")
     print("\nKi Spheres: Collect to launch Super Attacks (12 Ki) or Ultra Super Attacks (18 Ki).")
     print("Matching color = 2 Ki, others = 1 Ki, Rainbow (R) = 1 Ki.")
@@ -1402,6 +5069,9 @@ def show_game_info():
     print(f"- {SupportItem.ANDROID_8.value}: Recover 70% HP, and all allies' DEF +50% for 2 turns.")
     print(f"- {SupportItem.PRINCESS_SNAKE.value}: Recover 55% HP, damage received -30% for 1 turn.")
     print(f"- {SupportItem.WHIS.value}: Damage received -40% for 2 turns.")
+    print("\nType Advantage (damage multiplier range):")
+    for (attacker, defender), (low, high) in type_chart().items():
+        print(f"- {attacker.name} vs {defender.name}: x{low:.2f} to x{high:.2f}")
     print("\nEvasion System:")
     print("- Rare: 20% chance to evade")
     print("- Medium: 30% chance to evade")
@@ -1413,7 +5083,10 @@ def show_game_info():
     print("\nDokkan Mode:")
     print("- Collect Ki to fill the Dokkan Meter (24 Ki)")
     print("- Activate for a powerful attack with a Z-shape mini-game")
-    BattleSystem.press_any_key()
+    print("\nBoss Rush:")
+    print("- Fight 5 stages in a row, each stronger than the last")
+    print("- Team HP, Ki, items and the Dokkan Meter carry over between stages")
+    current_console().press_any_key()
 
 def create_goku_black_characters():
     characters = []
@@ -1584,7 +5257,7 @@ def create_goku_black_characters():
     
     return characters
 
-def start_new_battle():
+def create_vegeta_team():
     enemy_team = Team()
     
     # Create enemy character with proper attributes
@@ -1606,7 +5279,9 @@ def start_new_battle():
     vegeta.damage_reduction = 66
     vegeta.max_attacks_per_turn = 3
     enemy_team.add_member(vegeta)
+    return enemy_team
 
+def create_player_team(enemy_team, leader_skills=None):
     player_team = Team(is_player=True)
     
     # Add new characters
@@ -1637,11 +5312,129 @@ def start_new_battle():
     
     # Set leader
     player_team.members[0].is_leader = True
-    player_team.apply_leader_skill(player_team.members[0])
+    player_team.apply_leader_skill(player_team.members[0], leader_skills)
+    return player_team
+
+def start_new_battle():
+    enemy_team = create_vegeta_team()
+    player_team = create_player_team(enemy_team)
     
     battle = BattleSystem(player_team, enemy_team)
+    battle.save_path = save_path()
     battle.start_battle()
 
+def resume_saved_battle():
+    try:
+        battle = BattleSystem.load(save_path())
+    except ValueError as error:
+        print(f"\nCannot resume: {error}")
+        current_console().press_any_key()
+        return
+    battle.save_path = save_path()
+    battle.resume_battle()
+
+def start_boss_rush(stages=5):
+    player_team = create_player_team(Team())
+    start_event(player_team, boss_rush_stages(stages))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dokkan-Python")
+    parser.add_argument("--replay", nargs="+", metavar="SCRIPT",
+                        help="replay recorded answers (- for stdin) instead of reading the keyboard")
+    parser.add_argument("--record", metavar="SCRIPT", help="write every answer to SCRIPT for later replay")
+    parser.add_argument("--seed", type=int, help="random seed, needed to replay a recorded session exactly")
+    parser.add_argument("--verbose", action="store_true", help="print each replay transcript")
+    parser.add_argument("--serve", action="store_true", help="host a game per connection instead of playing locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", metavar="PATH", help="use a Unix socket instead of TCP")
+    parser.add_argument("--mark-prompts", action="store_true", help="end each prompt with a NUL byte for scripted clients")
+    parser.add_argument("--load-test", type=int, metavar="SESSIONS",
+                        help="play the --replay script in SESSIONS connections to a --mark-prompts server")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--metrics", metavar="PATH", help="export battle metrics to PATH.prom and PATH.json")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL, metavar="SECONDS")
+    parser.add_argument("--simulate", type=int, metavar="BATTLES",
+                        help="play BATTLES headless battles (seeds from --seed) and print the summary")
+    parser.add_argument("--compiled", action="store_true", help="with --simulate: use the turn compiler")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="with --simulate: sample stacks and write collapsed stacks for flame graphs to PATH")
+    parser.add_argument("--profile-interval", type=float, metavar="SECONDS",
+                        help=f"with --profile: seconds between samples (default {PROFILE_INTERVAL})")
+    args = parser.parse_args(argv)
+    if args.simulate is None:
+        for flag, value in (("--compiled", args.compiled), ("--profile", args.profile),
+                            ("--profile-interval", args.profile_interval)):
+            if value not in (None, False):
+                parser.error(f"{flag} needs --simulate")
+    if args.profile_interval is not None and not args.profile:
+        parser.error("--profile-interval needs --profile")
+    
+    if args.metrics:
+        BattleSystem.metrics = MetricsRegistry(args.metrics, args.metrics_interval)
+        atexit.register(BattleSystem.metrics.export)  # Final numbers, however the run ends
+    
+    if args.serve:
+        random.seed(args.seed)
+        try:
+            asyncio.run(serve_sessions(args.host, args.port, args.socket,
+                                       prompt_mark=PROMPT_MARK if args.mark_prompts else ""))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    
+    if args.simulate:
+        enemy_team = create_vegeta_team()
+        player_team = create_player_team(enemy_team)
+        profiler = SamplingProfiler(args.profile_interval or PROFILE_INTERVAL) if args.profile else None
+        if profiler:
+            profiler.start()
+        try:
+            stats = simulate_stats(player_team, enemy_team, args.simulate, args.seed or 0, compiled=args.compiled)
+        finally:
+            if profiler:
+                profiler.stop()
+        print(json.dumps(stats.summary(), indent=2, default=str))
+        if profiler:
+            profiler.write(args.profile)
+            print(f"\n{profiler.samples} samples written to {args.profile}", file=sys.stderr)
+            for phase, count in sorted(profiler.phase_totals().items(), key=lambda item: -item[1]):
+                print(f"{phase}: {count / profiler.samples:.1%}", file=sys.stderr)
+        return 0
+    
+    if args.load_test:
+        if not args.replay:
+            parser.error("--load-test needs a --replay script")
+        with open(args.replay[0]) as f:
+            answers, _ = read_script(f)
+        report = asyncio.run(load_test(args.load_test, answers, args.host, args.port, args.socket, args.concurrency))
+        print(json.dumps(report, indent=2))
+        return 0
+    
+    if args.replay:
+        failures = 0
+        for path, session in replay_scripts(args.replay, args.seed):
+            if args.verbose:
+                print(session.output)
+            status = "ok" if session.finished else "script ran out"
+            failures += not session.finished
+            print(f"{path}: {status} ({session.used}/{len(session.answers)} answers)")
+        return 1 if failures else 0
+    
+    seed = args.seed
+    if args.record:
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)  # Replays need the seed
+        random.seed(seed)
+        with open(args.record, "w") as f:
+            f.write(f"# seed {seed}\n")
+            # A replay starts without a save, so the recording must too
+            with use_console(RecordingConsole(f)), private_saves():
+                main_menu()
+    else:
+        random.seed(seed)
+        main_menu()
+    return 0
+
 if __name__ == "__main__":
-    random.seed()
-    main_menu()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
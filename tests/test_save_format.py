@@ -0,0 +1,78 @@
+import random
+import zlib
+
+import pytest
+
+import mydokkan
+from mydokkan import (SAVE_HEADER, SAVE_MAGIC, SAVE_VERSION, BattleSystem, encode_state, pack_save,
+                      unpack_save, create_player_team, create_vegeta_team)
+
+
+@pytest.fixture
+def battle():
+    random.seed(1)
+    enemy_team = create_vegeta_team()
+    return BattleSystem(create_player_team(enemy_team), enemy_team)
+
+
+def test_battle_round_trip(battle):
+    restored = BattleSystem.from_bytes(battle.to_bytes())
+    assert restored.turn_count == battle.turn_count
+    assert restored.inventory == battle.inventory
+    assert [(m.name, m.hp, m.attribute) for m in restored.enemy_team.members] == \
+        [(m.name, m.hp, m.attribute) for m in battle.enemy_team.members]
+    assert restored.player_team.total_hp == battle.player_team.total_hp
+    assert restored.to_bytes() == battle.to_bytes()
+
+
+def test_plain_values_round_trip():
+    state = {"n": [0, 255, 70000, -3, 2 ** 70], "x": (1.5, None, True, False), "s": b"\x00\xff", "e": "é"}
+    assert unpack_save(pack_save(state)) == state
+
+
+def test_checksum_mismatch(battle):
+    data = bytearray(battle.to_bytes())
+    data[-1] ^= 0xFF
+    with pytest.raises(ValueError, match="checksum"):
+        unpack_save(bytes(data))
+
+
+def test_truncated_and_foreign_data(battle):
+    data = battle.to_bytes()
+    with pytest.raises(ValueError, match="truncated"):
+        unpack_save(data[:SAVE_HEADER.size - 1])
+    with pytest.raises(ValueError, match="corrupt"):
+        unpack_save(data[:-1])
+    with pytest.raises(ValueError, match="Not a battle save"):
+        unpack_save(b"XXXX" + data[4:])
+
+
+def test_newer_version_rejected(battle):
+    data = battle.to_bytes()
+    header = SAVE_HEADER.unpack_from(data)
+    newer = SAVE_HEADER.pack(header[0], SAVE_VERSION + 1, *header[2:]) + data[SAVE_HEADER.size:]
+    with pytest.raises(ValueError, match="newer"):
+        unpack_save(newer)
+
+
+def test_unsavable_value():
+    with pytest.raises(ValueError):
+        pack_save({"too_long": "x" * 70000})
+
+
+def test_version_1_migration(battle):
+    state = unpack_save(battle.to_bytes())
+    for team in (state["battle"]["player_team"], state["battle"]["enemy_team"]):
+        for member in team.members:
+            del member.attribute_code
+    payload = encode_state(state)
+    data = SAVE_HEADER.pack(SAVE_MAGIC, 1, len(payload), zlib.crc32(payload)) + payload
+    
+    migrated = unpack_save(data)
+    for team in (migrated["battle"]["player_team"], migrated["battle"]["enemy_team"]):
+        for member in team.members:
+            assert member.attribute_code == mydokkan.ATTRIBUTE_CODES[member.attribute]
+
+
+def test_migrations_cover_every_older_version():
+    assert set(mydokkan.SAVE_MIGRATIONS) == set(range(1, SAVE_VERSION))
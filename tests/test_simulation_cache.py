@@ -0,0 +1,84 @@
+import math
+
+import pytest
+
+import mydokkan
+from mydokkan import SimulationCache, build_sweep_scenario, simulate_stats
+
+
+@pytest.fixture
+def scenario():
+    return build_sweep_scenario({"boss:attack": 20000, "boss:hp": 3000000})
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(SimulationCache, "CHUNK_SIZE", 10)
+    with SimulationCache(str(tmp_path / "cache.sqlite3")) as cache:
+        yield cache
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    """Seed chunks the cache asked to simulate"""
+    chunks = []
+    iter_chunk_stats = mydokkan.iter_chunk_stats
+    def spy(player_team, enemy_team, missing, *args, **kwargs):
+        chunks.extend(missing)
+        return iter_chunk_stats(player_team, enemy_team, missing, *args, **kwargs)
+    monkeypatch.setattr(mydokkan, "iter_chunk_stats", spy)
+    return chunks
+
+
+def assert_same_summary(cached, uncached):
+    """Merged chunks can differ from one pass in the last bits of floats"""
+    if isinstance(cached, dict):
+        assert cached.keys() == uncached.keys()
+        for key in cached:
+            assert_same_summary(cached[key], uncached[key])
+    elif isinstance(cached, float):
+        assert math.isclose(cached, uncached, rel_tol=1e-9)
+    else:
+        assert cached == uncached
+
+
+def test_split_on_chunk_boundaries(cache):
+    assert cache.split(5, 20) == [(5, 5), (10, 10), (20, 5)]
+    assert cache.split(0, 0) == []
+
+
+def test_cached_matches_uncached(scenario, cache, simulated):
+    player_team, enemy_team = scenario
+    first = cache.stats(player_team, enemy_team, 15).summary()
+    assert simulated == [(0, 10), (10, 5)]
+    assert_same_summary(first, simulate_stats(player_team, enemy_team, 15).summary())
+    
+    del simulated[:]
+    again = cache.stats(player_team, enemy_team, 15).summary()
+    assert simulated == []
+    assert again == first
+
+
+def test_extending_simulates_only_new_seeds(scenario, cache, simulated):
+    player_team, enemy_team = scenario
+    cache.stats(player_team, enemy_team, 15)
+    del simulated[:]
+    extended = cache.stats(player_team, enemy_team, 25).summary()
+    assert simulated == [(15, 5), (20, 5)]
+    assert_same_summary(extended, simulate_stats(player_team, enemy_team, 25).summary())
+    
+    del simulated[:]
+    assert_same_summary(cache.stats(player_team, enemy_team, 25).summary(), extended)
+    assert simulated == []
+
+
+def test_shorter_run_keeps_longer_chunk(scenario, cache, simulated):
+    player_team, enemy_team = scenario
+    cache.stats(player_team, enemy_team, 20)
+    del simulated[:]
+    shorter = cache.stats(player_team, enemy_team, 15).summary()
+    assert simulated == [(10, 5)]
+    assert_same_summary(shorter, simulate_stats(player_team, enemy_team, 15).summary())
+    del simulated[:]
+    cache.stats(player_team, enemy_team, 20)
+    assert simulated == []
@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+from mydokkan import (TraceReader, TraceWriter, build_sweep_scenario, log_simulations)
+
+ACTIONS = [
+    (1, "Goku", False, "Super Attack", "Vegeta", 120000.0, True, False, True, None, 500000.0),
+    (1, "Vegeta", True, "Normal Attack", "Goku", 0.0, False, True, False, None, 500000.0),
+    (2, "Goku", False, "Item", None, 0.0, False, False, False, "Senzu Bean", 750000.0),
+]
+RESULT = {"win": True, "turns": 2, "team_hp": 750000.0}
+
+
+def read_columns(directory, table):
+    """Plain lists of every column, views released so the reader can close"""
+    with TraceReader(directory) as reader:
+        columns = {}
+        for name, view in reader.table(table).items():
+            columns[name] = [value.item() if hasattr(value, "item") else value for value in view]
+            if isinstance(view, memoryview):
+                view.release()
+            del view
+        return reader.names, reader.scenarios, reader.rows(table), columns
+
+
+@pytest.fixture
+def scenario():
+    return build_sweep_scenario({"boss:attack": 20000, "boss:hp": 3000000})
+
+
+def test_round_trip(tmp_path, scenario):
+    directory = str(tmp_path / "trace")
+    with TraceWriter(directory) as writer:
+        index = writer.scenario(*scenario, label="sweep")
+        writer.add(index, 7, RESULT, ACTIONS)
+        writer.add(index, 8, dict(RESULT, win=False, turns=1), ACTIONS[:1])
+    
+    names, scenarios, rows, battles = read_columns(directory, "battles")
+    assert rows == 2
+    assert [scenario["label"] for scenario in scenarios] == ["sweep"]
+    assert battles["battle"] == [1, 2]
+    assert battles["seed"] == [7, 8]
+    assert battles["win"] == [1, 0]
+    assert battles["turns"] == [2, 1]
+    assert battles["team_hp"] == [750000.0, 750000.0]
+    
+    _, _, rows, actions = read_columns(directory, "actions")
+    assert rows == 4
+    assert actions["battle"] == [1, 1, 1, 2]
+    assert [names[id] for id in actions["actor"]] == ["Goku", "Vegeta", "Goku", "Goku"]
+    assert [names[id] for id in actions["target"]] == ["Vegeta", "Goku", None, "Vegeta"]
+    assert [names[id] for id in actions["item"]] == [None, None, "Senzu Bean", None]
+    assert actions["damage"] == [120000.0, 0.0, 0.0, 120000.0]
+    assert actions["flags"] == [2 | 8, 1 | 4, 0, 2 | 8]
+
+
+def test_columns_are_little_endian(tmp_path):
+    directory = str(tmp_path / "trace")
+    with TraceWriter(directory) as writer:
+        writer.add(0, 0x0102, RESULT, [])
+    with open(os.path.join(directory, "battles", "seed.bin"), "rb") as file:
+        assert file.read() == (0x0102).to_bytes(8, "little")
+    with open(os.path.join(directory, TraceWriter.SCHEMA_FILE)) as file:
+        schema = json.load(file)
+    assert schema["byteorder"] == "little"
+    assert all(column["dtype"].startswith("<") for table in schema["tables"].values() for column in table["columns"])
+
+
+def test_reopen_appends_and_drops_uncommitted_batch(tmp_path):
+    directory = str(tmp_path / "trace")
+    with TraceWriter(directory) as writer:
+        writer.add(0, 1, RESULT, ACTIONS)
+    with open(os.path.join(directory, "battles", "seed.bin"), "ab") as file:
+        file.write(b"\xff" * 8)  # A batch killed before its schema was written
+    
+    with TraceWriter(directory) as writer:
+        writer.add(0, 2, RESULT, ACTIONS[:1])
+    _, _, rows, battles = read_columns(directory, "battles")
+    assert rows == 2
+    assert battles["battle"] == [1, 2]
+    assert battles["seed"] == [1, 2]
+    assert os.path.getsize(os.path.join(directory, "battles", "seed.bin")) == 16
+
+
+def test_log_simulations_round_trip(tmp_path, scenario):
+    directory = str(tmp_path / "trace")
+    with TraceWriter(directory) as writer:
+        _, stats = log_simulations(writer, *scenario, battles=5, seed=3)
+    _, _, rows, battles = read_columns(directory, "battles")
+    assert rows == 5
+    assert battles["seed"] == [3, 4, 5, 6, 7]
+    assert sum(battles["win"]) == stats.wins